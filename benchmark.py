@@ -0,0 +1,589 @@
+"""
+Офлайн-бенчмарк бота: записанные ответы CryptoPanic, NewsAPI, RSS, CoinGecko и Telegram
+(каталог fixtures/) отдаёт локальная заглушка, поэтому сеть не нужна и результаты
+воспроизводимы.
+
+Меряются задержка (p50/p99) и пропускная способность:
+  • handle_news, handle_price, handle_volatility и подписка через кнопки — апдейты приходят
+    POST-запросами на встроенный вебхук бота (WebhookServer), как от Telegram; задержка —
+    от отправки запроса до конца обработки апдейта, ответы уходят в заглушку Bot API;
+  • операции с подписками (добавление, чтение, удаление);
+  • рассылка новостей: deliver_news для всех подписчиков и очередь отправки до опустошения.
+
+Каждый сценарий проверяется: у каждого пользователя есть ожидаемый ответ (а не текст
+ошибки), а число запросов к внешним API укладывается в ожидаемые пределы. Нарушения
+печатаются после таблицы, код выхода тогда 1.
+
+Пример:
+    python3 benchmark.py --users 5000 --coins 200 --subs-per-user 5 --requests 500
+
+Заглушка работает в отдельном процессе, чтобы не делить GIL с ботом. Состояние бота
+(база, история цен, справочник монет) создаётся во временном каталоге.
+"""
+import argparse
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(ROOT_DIR, "fixtures")
+BENCH_TOKEN = "123456:BENCH-TOKEN"
+BENCH_CHANNEL_ID = "-1001000000000"
+BENCH_WEBHOOK_SECRET = "bench-webhook-secret"
+FIRST_USER_ID = 100000001
+
+# Ответы бота, которых в сценариях быть не должно
+ERROR_REPLY_MARKERS = (
+    "Не удалось", "Не понял команду", "Список монет ещё загружается", "Не распознаны",
+    "не найден", "У вас нет подписок",
+)
+
+# Путь заглушки для каждого источника из news_sources.json
+NEWS_SOURCE_ROUTES = {
+    "CryptoPanic": "/cryptopanic/api/v1/posts/",
+    "NewsAPI": "/newsapi/v2/everything",
+    "CoinDesk": "/rss/coindesk",
+    "CoinTelegraph": "/rss/cointelegraph",
+}
+NEWS_FIXTURES = {
+    "/cryptopanic/api/v1/posts/": ("cryptopanic_posts.json", "application/json"),
+    "/newsapi/v2/everything": ("newsapi_everything.json", "application/json"),
+    "/rss/coindesk": ("coindesk_rss.xml", "application/rss+xml"),
+    "/rss/cointelegraph": ("cointelegraph_rss.xml", "application/rss+xml"),
+}
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return f.read() if not name.endswith(".json") else json.load(f)
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+# ---------------------- Заглушка внешних API ----------------------------------
+
+class StubUpstream:
+    """Данные заглушки: фикстуры, синтетические монеты сверх записанных, счётчики запросов."""
+
+    def __init__(self, coins: int, latency: float, conditional: bool, seed: int):
+        self.latency = latency
+        self.conditional = conditional
+        self.requests = {}
+        self._lock = threading.Lock()
+        self.news = {}
+        for path, (name, content_type) in NEWS_FIXTURES.items():
+            data = load_fixture(name)
+            body = (json.dumps(data) if isinstance(data, (dict, list)) else data).encode("utf-8")
+            self.news[path] = (body, content_type, hashlib.sha1(body).hexdigest())
+
+        rng = random.Random(seed)
+        recorded = load_fixture("coingecko_coins_markets.json")
+        self.markets = {item["id"]: item for item in recorded}
+        self.coins_list = load_fixture("coingecko_coins_list.json")
+        for i in range(max(0, coins - len(recorded))):
+            template = recorded[i % len(recorded)]
+            coin_id = f"bench-coin-{i}"
+            item = dict(template, id=coin_id, symbol=f"bc{i}", name=f"Bench Coin {i}",
+                        market_cap_rank=len(recorded) + i + 1)
+            item["current_price"] = round(rng.uniform(0.01, 500), 6)
+            for window in ("1h", "24h", "7d", "14d", "30d"):
+                item[f"price_change_percentage_{window}_in_currency"] = round(rng.gauss(0, 5), 4)
+            self.markets[coin_id] = item
+            self.coins_list.append({"id": coin_id, "symbol": item["symbol"], "name": item["name"]})
+        self.market_ids = list(self.markets)
+
+        self.telegram = load_fixture("telegram_api.json")
+        self._message_id = 0
+        # Пришедшие sendMessage: [chat_id, текст, time.monotonic (общий для процессов)]
+        self.sent = []
+
+    def count(self, route: str):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def message_sent(self, chat_id: str, text: str) -> int:
+        with self._lock:
+            self._message_id += 1
+            self.sent.append([chat_id, text, time.monotonic()])
+            return self._message_id
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят разными send(): с Nagle каждый ответ ждал бы отложенного ACK (~40 мс)
+    disable_nagle_algorithm = True
+    upstream: StubUpstream = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data, status: int = 200):
+        self._send(status, json.dumps(data).encode("utf-8"))
+
+    def do_GET(self):
+        upstream = self.upstream
+        if upstream.latency:
+            time.sleep(upstream.latency)
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path in upstream.news:
+            upstream.count(url.path)
+            body, content_type, etag = upstream.news[url.path]
+            if upstream.conditional and self.headers.get("If-None-Match") == etag:
+                self._send(304, headers={"ETag": etag})
+            else:
+                self._send(200, body, content_type, {"ETag": etag} if upstream.conditional else None)
+        elif url.path == "/__stats":
+            with upstream._lock:
+                self._json({"requests": upstream.requests, "sent": upstream.sent})
+        elif url.path == "/coingecko/coins/list":
+            upstream.count("coingecko:coins/list")
+            self._json(upstream.coins_list)
+        elif url.path == "/coingecko/coins/markets":
+            upstream.count("coingecko:coins/markets")
+            ids = [c for c in query.get("ids", "").split(",") if c]
+            if ids:
+                items = [upstream.markets[c] for c in ids if c in upstream.markets]
+            else:
+                per_page = int(query.get("per_page", 100))
+                items = sorted(upstream.markets.values(), key=lambda m: m["market_cap_rank"])[:per_page]
+            self._json(items)
+        elif url.path == "/coingecko/simple/price":
+            upstream.count("coingecko:simple/price")
+            ids = [c for c in query.get("ids", "").split(",") if c]
+            currency = query.get("vs_currencies", "usd").split(",")[0]
+            self._json({
+                c: {currency: upstream.markets[c]["current_price"]} for c in ids if c in upstream.markets
+            })
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def _payload(self) -> dict:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0)).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body or "{}")
+        return {k: v[0] for k, v in parse_qs(body).items()}
+
+    def do_POST(self):
+        upstream = self.upstream
+        payload = self._payload()
+        if upstream.latency:
+            time.sleep(upstream.latency)
+        method = urlsplit(self.path).path.rsplit("/", 1)[-1]
+        upstream.count(f"telegram:{method}")
+        response = upstream.telegram.get(method)
+        if response is None:
+            self._json({"ok": True, "result": True})
+            return
+        if method == "sendMessage":
+            response = json.loads(json.dumps(response))
+            response["result"]["message_id"] = upstream.message_sent(str(payload.get("chat_id")), payload.get("text", ""))
+            response["result"]["date"] = int(time.time())
+        self._json(response)
+
+def serve_stub(upstream_args: tuple, port_queue):
+    """Точка входа процесса заглушки."""
+    handler = type("BoundStubHandler", (StubHandler,), {"upstream": StubUpstream(*upstream_args)})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def start_stub(upstream_args: tuple) -> tuple:
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stub, args=(upstream_args, port_queue), name="stub-upstream", daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+async def stub_stats(client, stub_url: str) -> dict:
+    resp = await client.get(f"{stub_url}/__stats")
+    return resp.json()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def configure_environment(args, stub_url: str, workdir: str):
+    """Окружение бота до импорта news_ai_bot: все адреса смотрят в заглушку, состояние — во workdir."""
+    with open(os.path.join(ROOT_DIR, "news_sources.json"), "r", encoding="utf-8") as f:
+        sources = json.load(f)
+    for source in sources:
+        source["url"] = stub_url + NEWS_SOURCE_ROUTES.get(source["name"], "/missing")
+    sources_file = os.path.join(workdir, "news_sources.json")
+    with open(sources_file, "w", encoding="utf-8") as f:
+        json.dump(sources, f)
+
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BENCH_TOKEN,
+        "TELEGRAM_API_URL": f"{stub_url}/telegram/bot",
+        "TELEGRAM_GLOBAL_RATE": str(args.telegram_rate),
+        "TELEGRAM_MODE": "webhook",
+        "WEBHOOK_LISTEN": "127.0.0.1",
+        "PORT": str(free_port()),
+        "WEBHOOK_SECRET_TOKEN": BENCH_WEBHOOK_SECRET,
+        "CHANNEL_ID": BENCH_CHANNEL_ID,
+        "COINGECKO_API_URL": f"{stub_url}/coingecko",
+        "NEWS_SOURCES_FILE": sources_file,
+        "CRYPTOPANIC_API_KEY": "bench",
+        "NEWSAPI_API_KEY": "bench",
+        "STORAGE_BACKEND": args.storage,
+        "STORAGE_DB_FILE": os.path.join(workdir, "bot_state.db"),
+        "PRICE_HISTORY_DIR": os.path.join(workdir, "price_history"),
+        "COIN_INDEX_FILE": os.path.join(workdir, "coin_index.json"),
+    })
+    # JSON-хранилище пишет файлы в текущий каталог
+    os.chdir(workdir)
+
+# ---------------------- Сценарии ----------------------------------------------
+
+class Results:
+    def __init__(self):
+        self.rows = []
+        self.failures = []
+
+    def check(self, name: str, ok: bool, message: str):
+        if not ok:
+            self.failures.append(f"{name}: {message}")
+
+    def add(self, name: str, latencies: list, wall: float, **extra):
+        row = {
+            "operation": name,
+            "count": len(latencies),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+            "ops_per_s": round(len(latencies) / wall, 1) if wall > 0 else None,
+        }
+        row.update(extra)
+        self.rows.append(row)
+        return row
+
+    def print_table(self):
+        header = f"{'operation':<28}{'count':>8}{'p50 ms':>11}{'p99 ms':>11}{'max ms':>11}{'ops/s':>11}"
+        print(header)
+        print("-" * len(header))
+        for row in self.rows:
+            print(
+                f"{row['operation']:<28}{row['count']:>8}{row['p50_ms']:>11.3f}{row['p99_ms']:>11.3f}"
+                f"{row['max_ms']:>11.3f}{row['ops_per_s'] if row['ops_per_s'] is not None else '-':>11}"
+            )
+
+def timed_ops(func, args_list: list) -> tuple:
+    latencies = []
+    started = time.perf_counter()
+    for args in args_list:
+        t = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - started
+
+class WebhookDriver:
+    """
+    Доставка апдейтов через встроенный вебхук бота: POST с секретным заголовком, как от
+    Telegram. Вебхук отвечает 200 сразу после постановки апдейта в очередь, поэтому конец
+    обработки отмечает обёртка над Application.process_update, которую получает вебхук.
+    """
+
+    def __init__(self, application, url: str, secret: str):
+        self.application = application
+        self.bot = application.bot
+        self.url = url
+        self.secret = secret
+        self._pending = {}  # update_id -> future с моментом конца обработки
+
+    async def process_update(self, update):
+        try:
+            await self.application.process_update(update)
+        finally:
+            future = self._pending.pop(update.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+
+    async def deliver(self, client, data: dict) -> float:
+        """Отправляет апдейт и ждёт конца его обработки; возвращает задержку в секундах."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[data["update_id"]] = future
+        started = time.perf_counter()
+        resp = await client.post(self.url, json=data, headers={"X-Telegram-Bot-Api-Secret-Token": self.secret})
+        if resp.status_code != 200:
+            self._pending.pop(data["update_id"], None)
+            raise RuntimeError(f"вебхук ответил {resp.status_code} на апдейт {data['update_id']}")
+        return await future - started
+
+async def run_updates(driver: WebhookDriver, client, updates: list, concurrency: int) -> tuple:
+    """Прогоняет цепочки апдейтов (цепочка одного пользователя — по порядку) с ограничением параллельности."""
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_chain(chain):
+        async with slots:
+            for data in chain:
+                latencies.append(await driver.deliver(client, data))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_chain(chain) for chain in updates))
+    return latencies, time.perf_counter() - started
+
+def make_update(template: dict, update_id: int, user_id: int) -> dict:
+    data = json.loads(json.dumps(template))
+    data["update_id"] = update_id
+    data["message"]["message_id"] = update_id
+    data["message"]["from"]["id"] = user_id
+    data["message"]["chat"]["id"] = user_id
+    return data
+
+# Сценарии: имя, цепочка апдейтов, ожидаемый ответ (варианты; в варианте — все подстроки),
+# опрашивает ли обработчик источники новостей
+SCENARIOS = [
+    ("handle_news", ("news",),
+     (("Новости по вашим подпискам",), ("Нет актуальных новостей по вашим подпискам",)), True),
+    ("handle_price", ("price",), ((" USD",),), False),
+    ("handle_volatility", ("volatility",), (("Динамика курсов",),), False),
+    # "btc, etherium, solana": тикер по капитализации, опечатка с подсказкой
+    ("subscribe (2 updates)", ("subscribe", "subscribe_input"), (("bitcoin", "solana", "возможно, ethereum"),), False),
+]
+
+def check_scenario(results: Results, name: str, chains: list, chain_length: int, expected: tuple,
+                   news_fetches: bool, before: dict, after: dict):
+    """
+    Каждый запрос пользователя получил ожидаемый ответ и ни одного текста ошибки; источники
+    новостей опрашивались только в сценарии новостей и не чаще, чем по разу на запрос;
+    к CoinGecko обращений не было (всё есть в снимке рынка).
+    """
+    replies = {}
+    for chat_id, text, _ in after["sent"][len(before["sent"]):]:
+        replies.setdefault(chat_id, []).append(text)
+
+    missing = []
+    for chain in chains:
+        chat_id = str(chain[0]["message"]["chat"]["id"])
+        texts = replies.get(chat_id, [])
+        matched = sum(any(all(part in text for part in variant) for variant in expected) for text in texts)
+        if matched < len(chain) // chain_length:
+            missing.append(chat_id)
+    results.check(name, not missing,
+                  f"нет ожидаемого ответа у {len(missing)} из {len(chains)} пользователей (например, {missing[:3]})")
+    errors = [text for texts in replies.values() for text in texts
+              if any(marker in text for marker in ERROR_REPLY_MARKERS)]
+    results.check(name, not errors, f"{len(errors)} ответов с ошибкой, например: {errors[:1]}")
+
+    requests = sum(len(chain) // chain_length for chain in chains)
+    hits = {route: after["requests"].get(route, 0) - before["requests"].get(route, 0) for route in after["requests"]}
+    for route in NEWS_FIXTURES:
+        count = hits.get(route, 0)
+        if news_fetches:
+            results.check(name, 1 <= count <= requests, f"{route}: {count} запросов на {requests} обращений")
+        else:
+            results.check(name, count == 0, f"{route}: {count} лишних запросов")
+    coingecko = {route: count for route, count in hits.items() if route.startswith("coingecko:") and count}
+    results.check(name, not coingecko, f"лишние запросы к CoinGecko: {coingecko}")
+
+async def wait_for_sender(bot, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while bot.message_sender.queue_depth() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    return not bot.message_sender.queue_depth()
+
+async def run_benchmark(args, upstream: StubUpstream, stub_url: str) -> tuple:
+    sys.path.insert(0, ROOT_DIR)
+    import news_ai_bot as bot
+
+    # Логи бота в отчёте — шум
+    logging.getLogger("CryptoNewsBot").setLevel(logging.INFO if args.verbose else logging.ERROR)
+    rng = random.Random(args.seed)
+    results = Results()
+
+    # Справочник монет и снимок рынка — как после обычного запуска
+    await bot.load_supported_coins()
+    universe = upstream.market_ids[:args.coins]
+    user_ids = [str(FIRST_USER_ID + i) for i in range(args.users)]
+
+    plan = [
+        (user_id, coin)
+        for user_id in user_ids
+        for coin in rng.sample(universe, min(args.subs_per_user, len(universe)))
+    ]
+    latencies, wall = timed_ops(bot.add_subscription, plan)
+    results.add("subscription.add", latencies, wall)
+
+    await bot.poll_market_data()
+    if args.history_hours:
+        now = time.time()
+        prices = {coin: upstream.markets[coin]["current_price"] for coin in universe}
+        for step in range(int(args.history_hours * 60), 0, -1):
+            prices = {coin: price * (1 + rng.gauss(0, 0.002)) for coin, price in prices.items()}
+            bot.price_history.record(prices, now - step * 60)
+        bot.rolling_stats.warm_up(bot.price_history, universe, now)
+
+    application = bot.build_application(post_init=None, post_shutdown=None)
+    await application.initialize()
+    bot.message_sender.start(application.bot)
+    driver = WebhookDriver(
+        application, f"http://127.0.0.1:{bot.WEBHOOK_PORT}{bot.WEBHOOK_PATH}", bot.WEBHOOK_SECRET_TOKEN,
+    )
+    await bot.webhook_server.start(driver, bot.WEBHOOK_LISTEN, bot.WEBHOOK_PORT)
+    client = httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency))
+
+    templates = load_fixture("telegram_updates.json")
+    update_id = 0
+
+    def scenario_chains(keys: tuple, count: int) -> list:
+        """
+        count запросов (по цепочке апдейтов keys) от разных пользователей. Запросов больше,
+        чем пользователей, — цепочки одного пользователя склеиваются и идут по порядку,
+        чтобы его диалоги с ботом не перемешивались.
+        """
+        nonlocal update_id
+        users = rng.sample(user_ids, min(count, len(user_ids)))
+        chains = {}
+        for i in range(count):
+            user_id = int(users[i % len(users)])
+            for key in keys:
+                update_id += 1
+                chains.setdefault(user_id, []).append(make_update(templates[key], update_id, user_id))
+        return list(chains.values())
+
+    for name, keys, expected, news_fetches in SCENARIOS:
+        chains = scenario_chains(keys, args.requests)
+        before = await stub_stats(client, stub_url)
+        latencies, wall = await run_updates(driver, client, chains, args.concurrency)
+        # Подборки, поставленные в очередь обработчиками, тоже ответы сценария и не должны
+        # попасть в замер рассылки
+        await wait_for_sender(bot, args.drain_timeout)
+        after = await stub_stats(client, stub_url)
+        results.add(name, latencies, wall)
+        check_scenario(results, name, chains, len(keys), expected, news_fetches, before, after)
+
+    lookups = [(rng.choice(user_ids),) for _ in range(args.sub_ops)]
+    latencies, wall = timed_ops(bot.get_user_subscriptions, lookups)
+    results.add("subscription.get", latencies, wall)
+    removals = rng.sample(plan, min(args.sub_ops, len(plan)))
+    latencies, wall = timed_ops(bot.remove_subscription, removals)
+    results.add("subscription.remove", latencies, wall)
+    timed_ops(bot.add_subscription, removals)
+
+    # Рассылка: свежие новости всем подписчикам, затем ждём опустошения очереди
+    news = await bot.fetch_all_news()
+    before = await stub_stats(client, stub_url)
+    sender_before = bot.message_sender.stats()
+    started = time.monotonic()
+    stories = bot.deliver_news(application, news)
+    enqueue_time = time.monotonic() - started
+    queued = bot.message_sender.queue_depth()
+    drained = await wait_for_sender(bot, args.drain_timeout)
+    wall = time.monotonic() - started
+    sender = bot.message_sender.stats()
+    sent = sender["sent"] - sender_before["sent"]
+    stats = await stub_stats(client, stub_url)
+    # Все сообщения рассылки поставлены в очередь в момент started: задержка — до прихода в Bot API
+    broadcast = stats["sent"][len(before["sent"]):]
+    latencies = [t - started for _, _, t in broadcast]
+    results.add(
+        "broadcast", latencies, wall,
+        stories=stories, messages=queued, sent=sent, drained=drained, enqueue_ms=round(enqueue_time * 1000, 3),
+    )
+    results.check("broadcast", stories > 0, "нет ни одной истории для рассылки")
+    results.check("broadcast", drained and len(broadcast) == queued,
+                  f"поставлено в очередь {queued} сообщений, до Bot API дошло {len(broadcast)}")
+    results.check("broadcast", any(chat_id == BENCH_CHANNEL_ID for chat_id, _, _ in broadcast),
+                  f"в канал {BENCH_CHANNEL_ID} ничего не отправлено")
+
+    await bot.webhook_server.stop()
+    await client.aclose()
+    await application.shutdown()
+    await bot.HTTP_CLIENT.aclose()
+    return results, stats["requests"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк CryptoNewsBot на записанных ответах API.")
+    parser.add_argument("--users", type=int, default=1000, help="число подписчиков")
+    parser.add_argument("--coins", type=int, default=50, help="сколько разных монет в подписках")
+    parser.add_argument("--subs-per-user", type=int, default=3, help="подписок на пользователя")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на каждый обработчик")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных запросов к обработчикам")
+    parser.add_argument("--sub-ops", type=int, default=5000, help="операций чтения/удаления подписок")
+    parser.add_argument("--history-hours", type=float, default=24, help="часов синтетической истории цен")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка ответа заглушки API")
+    parser.add_argument("--no-conditional", action="store_true",
+                        help="не отдавать ETag/304: каждый запрос новостей разбирается заново")
+    parser.add_argument("--telegram-rate", type=float, default=1000.0,
+                        help="общий лимит отправки, сообщений/с (у Telegram по умолчанию 30)")
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="сколько ждать опустошения очереди, с")
+    parser.add_argument("--storage", choices=("sqlite", "json"), default="sqlite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="FILE", help="сохранить результаты в JSON")
+    parser.add_argument("--verbose", action="store_true", help="не приглушать логи бота")
+    args = parser.parse_args()
+    if args.json:
+        # Бенчмарк работает во временном каталоге — относительный путь считаем от исходного
+        args.json = os.path.abspath(args.json)
+    return args
+
+def main():
+    args = parse_args()
+    upstream_args = (args.coins, args.latency_ms / 1000, not args.no_conditional, args.seed)
+    # Тот же seed даёт те же монеты и цены, что и в процессе заглушки
+    upstream = StubUpstream(*upstream_args)
+    process, stub_url = start_stub(upstream_args)
+    # Бот сбрасывает хранилище в atexit относительно текущего каталога: каталог удаляется
+    # последним (atexit выполняется в обратном порядке), а рабочий каталог до выхода не меняется
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    try:
+        configure_environment(args, stub_url, workdir)
+        results, upstream_requests = asyncio.run(run_benchmark(args, upstream, stub_url))
+    finally:
+        process.terminate()
+
+    print(
+        f"users={args.users} coins={args.coins} subs/user={args.subs_per_user} requests={args.requests} "
+        f"concurrency={args.concurrency} upstream latency={args.latency_ms} ms storage={args.storage}"
+    )
+    results.print_table()
+    broadcast = results.rows[-1]
+    print(
+        f"\nbroadcast: {broadcast['stories']} stories, {broadcast['messages']} messages queued in "
+        f"{broadcast['enqueue_ms']} ms, sent {broadcast['sent']}"
+        f"{'' if broadcast['drained'] else ' (queue NOT drained before timeout)'}"
+    )
+    print(f"upstream requests: {dict(sorted(upstream_requests.items()))}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "args": vars(args), "results": results.rows, "upstream_requests": upstream_requests,
+                "failures": results.failures,
+            }, f, indent=2)
+    if results.failures:
+        print("\nFAILED checks:")
+        for failure in results.failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+Окружение для тестов. news_ai_bot читает настройки и открывает хранилище при импорте,
+поэтому до импорта задаём токен и уводим всё состояние (базу, историю цен,
+справочник монет) во временный каталог.
+"""
+import os
+import tempfile
+
+_STATE_DIR = tempfile.mkdtemp(prefix="bot-tests-")
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:test")
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["STORAGE_DB_FILE"] = os.path.join(_STATE_DIR, "bot_state.db")
+os.environ["PRICE_HISTORY_DIR"] = os.path.join(_STATE_DIR, "price_history")
+os.environ["COIN_INDEX_FILE"] = os.path.join(_STATE_DIR, "coin_index.json")
+os.environ["NEWS_SOURCES_FILE"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "news_sources.json")
@@ -1,27 +1,58 @@
 import os
 import time
 import logging
-import requests
+import asyncio
 import json
+import math
+import multiprocessing
 import re
 import feedparser
 import threading
+import hashlib
+import html
+import heapq
+import calendar
+import atexit
+import sqlite3
+import random
+import hmac
+import signal
+import socket
+import zlib
 
+from collections import deque
+from contextlib import contextmanager
+
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+import numpy as np
 from dotenv import load_dotenv
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from pycoingecko import CoinGeckoAPI
+
+import sentiment_worker
 
 from telegram import (
     Update,
-    ParseMode,
     ReplyKeyboardMarkup,
 )
+from telegram.constants import ParseMode
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    Forbidden,
+    RetryAfter,
+)
 from telegram.ext import (
-    Updater,
+    Application,
     CommandHandler,
     CallbackContext,
     MessageHandler,
-    Filters,
+    filters,
 )
 
 # Настройка логирования
@@ -29,12 +60,39 @@ LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 logger = logging.getLogger("CryptoNewsBot")
 
+class StartupTimer:
+    """Длительность этапов запуска (секунды): что занимает время до начала работы бота."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self.phases = {}
+
+    def mark(self, name: str):
+        """Этап, который начался с прошлой отметки и закончился сейчас."""
+        now = time.perf_counter()
+        self.phases[name] = round(now - self._last_mark, 3)
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 3)
+
+    def elapsed(self) -> float:
+        return round(time.perf_counter() - self.started, 3)
+
+startup = StartupTimer()
+# httpx пишет в INFO каждый запрос, включая постоянный getUpdates
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
 # Загрузка переменных окружения из .env (Укажите свой путь)
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
-CRYPTOPANIC_API_KEY = os.getenv("CRYPTOPANIC_API_KEY", "")
-NEWSAPI_API_KEY = os.getenv("NEWSAPI_API_KEY", "")
 
 if not TELEGRAM_BOT_TOKEN:
     logger.error("Не указан TELEGRAM_BOT_TOKEN. Выход.")
@@ -43,41 +101,538 @@ if not TELEGRAM_BOT_TOKEN:
 NEWS_STORAGE_FILE = "last_news_id.dat"
 PREVIOUS_PRICES_FILE = "previous_prices.json"
 SUBSCRIPTIONS_FILE = "subscriptions.json"
+OUTBOX_FILE = "outbox.json"
+ALERT_RULES_FILE = "price_alerts.json"
+
+# Планировщик: случайный разброс интервалов задач (доля интервала)
+SCHEDULER_JITTER = 0.1
+# Адаптивный опрос: во сколько раз меняется интервал, если новости были / не было
+ADAPTIVE_SPEEDUP = 0.5
+ADAPTIVE_SLOWDOWN = 1.5
+# Интервалы остальных задач (секунды)
+# Оповещения о ценах проверяются в такт с обновлением снимка рынка
+PRICE_CHECK_INTERVAL = int(os.getenv("PRICE_CHECK_INTERVAL", "60"))
+COIN_LIST_REFRESH_INTERVAL = 24 * 3600
+STATS_LOG_INTERVAL = 3600
+
+# Файл с описанием источников новостей (тип, URL, ключ, интервал опроса, таймаут, парсер)
+NEWS_SOURCES_FILE = os.getenv("NEWS_SOURCES_FILE", "news_sources.json")
+# Значения по умолчанию для источника: таймаут (с) и интервал опроса (с)
+NEWS_SOURCE_TIMEOUT = 10
+NEWS_SOURCE_POLL_INTERVAL = 3600
+# Общий дедлайн сбора новостей со всех источников (секунды)
+NEWS_FETCH_DEADLINE = 15
+# Общий пул HTTP-соединений для источников новостей и CoinGecko
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE = 16
+# Сколько апдейтов Telegram обрабатывать одновременно
+HANDLER_CONCURRENCY = int(os.getenv("HANDLER_CONCURRENCY", "1024"))
+
+# Вебхук: публичный адрес бота (например, https://<app>.herokuapp.com). Если задан,
+# по умолчанию включается режим "webhook", иначе "polling" (getUpdates)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "webhook" if WEBHOOK_URL else "polling").lower()
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена бота
+WEBHOOK_SECRET_TOKEN = (
+    os.getenv("WEBHOOK_SECRET_TOKEN")
+    or hashlib.sha256(TELEGRAM_BOT_TOKEN.encode()).hexdigest()[:32]
+)
+# Сколько апдейтов может ждать обработки, максимальный размер тела и таймаут чтения запроса
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_MAX_BODY = 1024 * 1024
+WEBHOOK_READ_TIMEOUT = 30
+
+# Сколько помнить уже отправленные новости (секунды) и максимум записей в индексе
+NEWS_SEEN_TTL = 7 * 24 * 3600
+NEWS_SEEN_MAX_ENTRIES = 5000
+
+# Склейка похожих новостей из разных источников: MinHash по символьным шинглам заголовка
+# и LSH-индекс (bands полос по NEWS_MINHASH_PERMUTATIONS / bands значений)
+NEWS_SHINGLE_SIZE = 4
+NEWS_MINHASH_PERMUTATIONS = 64
+NEWS_LSH_BANDS = 16
+# С какой оценкой сходства Жаккара два заголовка считаются одной историей
+NEWS_CLUSTER_THRESHOLD = 0.5
+# Сколько помнить разосланные истории, чтобы не слать их поздние дубликаты (секунды)
+NEWS_CLUSTER_TTL = 24 * 3600
+
+# Хранилище состояния: "sqlite" (по умолчанию) или "json" (старые отдельные файлы)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+STORAGE_DB_FILE = os.getenv("STORAGE_DB_FILE", "bot_state.db")
+# Задержка пакетной записи JSON-файлов на диск (секунды)
+STORAGE_FLUSH_DELAY = 2.0
 
-# Через сколько секунд выполнять планировщик (например, раз в час)
-POLL_INTERVAL = 3600
+# Несколько экземпляров бота (процессы или машины с общей базой SQLite): всего WORKER_COUNT,
+# номер этого — WORKER_INDEX. Рассылку новостей и оповещения выполняет воркер, который держит
+# аренду задачи, личные сообщения отправляет воркер, которому принадлежит чат
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{WORKER_INDEX}"
+# Запас аренды задачи сверх времени до её следующего запуска (секунды)
+JOB_LEASE_GRACE = 60
+# Как часто подхватывать изменения других воркеров: подписки и очередь сообщений (секунды)
+SHARED_STATE_SYNC_INTERVAL = 2
 
 # ID вашего канала (должен быть админом в канале, если используете getChatMember)
-CHANNEL_ID = -1002126621893
+CHANNEL_ID = int(os.getenv("CHANNEL_ID", "-1002126621893"))
 # Ссылка-приглашение в канал
 CHANNEL_INVITE_LINK = "https://t.me/+M62co0BH-pIwN2Fi"
 
-cg = CoinGeckoAPI()
-analyzer = SentimentIntensityAnalyzer()
+# Кэш CoinGecko: сколько секунд ответ считается свежим для каждого метода
+COINGECKO_CACHE_TTL = {
+    "get_price": 30,
+    "get_coins_markets": 60,
+    "get_coins_list": 6 * 3600,
+}
+# Сколько ещё секунд после TTL можно отдавать устаревший ответ, обновляя его в фоне
+COINGECKO_STALE_TTL = 600
+# Пауза в обращениях к CoinGecko после ошибки/429, пока есть что отдать из кэша
+COINGECKO_ERROR_BACKOFF = 30
+# Таймаут одного запроса к CoinGecko (секунды)
+COINGECKO_TIMEOUT = 10
+COINGECKO_API_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+
+# Рассылать ли подписчикам личные подборки новостей по их монетам после каждого цикла
+PERSONAL_NEWS_ENABLED = os.getenv("PERSONAL_NEWS_ENABLED", "1") != "0"
+
+# Адрес Bot API (свой сервер telegram-bot-api или локальная заглушка для benchmark.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+# Лимиты Telegram: сообщений в секунду на весь бот, в личный чат и в группу/канал
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_PRIVATE_CHAT_RATE = 1.0
+TELEGRAM_GROUP_CHAT_RATE = 20 / 60
+TELEGRAM_GROUP_CHAT_BURST = 3
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+# Сколько сообщений отправлять параллельно и сколько раз повторять при сетевых ошибках
+SEND_WORKERS = 4
+SEND_MAX_ATTEMPTS = 5
+
+# Кэш тональности: сколько заголовков помнить
+SENTIMENT_CACHE_SIZE = 10000
+# Процессов для оценки больших пачек заголовков (0 — считать в текущем процессе)
+SENTIMENT_PROCESSES = int(os.getenv("SENTIMENT_PROCESSES", "0"))
+# С какого размера пачки имеет смысл отдавать её в пул процессов
+SENTIMENT_PROCESS_MIN_BATCH = 200
+
+# Сколько новостей максимум показывать в одной подборке (0 — без ограничения)
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "30"))
+
+# Как часто обновлять снимок рынка по всем отслеживаемым монетам (секунды)
+MARKET_POLL_INTERVAL = 60
+# Сколько id монет отправлять в одном запросе /coins/markets (максимум per_page у CoinGecko)
+MARKET_IDS_PER_REQUEST = 250
+MARKET_PRICE_CHANGE_PERIODS = "1h,24h,7d,14d,30d"
+
+# Окна правил оповещений: "ref" — изменение от цены на момент установки правила или
+# прошлого срабатывания, остальные — изменение за период по данным CoinGecko
+ALERT_WINDOWS = ("ref",) + tuple(MARKET_PRICE_CHANGE_PERIODS.split(","))
+# Сработавшее правило молчит не меньше ALERT_COOLDOWN секунд и снова взводится, только
+# когда |изменение| опустится ниже порога * ALERT_REARM_RATIO (гистерезис)
+ALERT_COOLDOWN = int(os.getenv("ALERT_COOLDOWN", "3600"))
+ALERT_REARM_RATIO = 0.5
+ALERT_MAX_RULES_PER_USER = 50
+
+# История цен: уровни детализации (имя, шаг бара в секундах, сколько хранить в секундах).
+# Каждая выборка из снимка рынка сразу попадает во все уровни
+PRICE_HISTORY_DIR = os.getenv("PRICE_HISTORY_DIR", "price_history")
+PRICE_HISTORY_TIERS = (
+    ("1m", 60, 2 * 24 * 3600),
+    ("15m", 15 * 60, 14 * 24 * 3600),
+    ("4h", 4 * 3600, 400 * 24 * 3600),
+)
+# Сколько файлов истории держать открытыми (каждый memmap занимает дескриптор);
+# давно не использованные закрываются
+PRICE_HISTORY_OPEN_FILES = int(os.getenv("PRICE_HISTORY_OPEN_FILES", "256"))
+# Окно волатильности -> (уровень истории, длина окна в секундах)
+VOLATILITY_WINDOWS = {
+    "1h": ("1m", 3600),
+    "24h": ("15m", 24 * 3600),
+    "7d": ("15m", 7 * 24 * 3600),
+    "14d": ("4h", 14 * 24 * 3600),
+    "30d": ("4h", 30 * 24 * 3600),
+}
+# Какую долю окна должна покрывать своя история, чтобы не брать изменение у CoinGecko
+VOLATILITY_MIN_COVERAGE = 0.9
+# Окна скользящей статистики в памяти (секунды): обновляются с каждым снимком рынка,
+# для остальных окон VOLATILITY_WINDOWS метрики считаются по истории цен
+ROLLING_WINDOWS = {"1h": 3600, "24h": 24 * 3600}
+
+# Справочник монет CoinGecko (id, тикер, название): снимок на диске, обновляется в фоне
+COIN_INDEX_FILE = os.getenv("COIN_INDEX_FILE", "coin_index.json")
+# Сколько монет с наибольшей капитализацией ранжировать, когда тикер есть у нескольких монет
+COIN_INDEX_RANKED = 250
+# Минимальное сходство по триграммам (коэффициент Дайса) для подсказки при опечатке
+COIN_SUGGEST_MIN_SCORE = 0.5
+# Сколько раз повторить запрос капитализации при обновлении справочника, если её ещё нет;
+# пока справочник пуст, запрос повторяется до успеха с паузой не больше COIN_INDEX_RETRY_MAX_DELAY
+COIN_INDEX_RANK_RETRIES = 3
+COIN_INDEX_RETRY_MAX_DELAY = 600
+# Сколько обработчик ждёт загрузки справочника с диска сразу после запуска
+COIN_INDEX_WAIT = 5
+
+# ---------------------- Кэш CoinGecko -----------------------------------------
+
+class AsyncCoinGecko:
+    """
+    Асинхронный клиент CoinGecko API v3 — только методы, которые нужны боту.
+    Параметры передаются как в pycoingecko: списки склеиваются через запятую.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str = COINGECKO_API_URL,
+                 timeout: float = COINGECKO_TIMEOUT):
+        self.client = client
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    @staticmethod
+    def _params(kwargs: dict) -> dict:
+        params = {}
+        for name, value in kwargs.items():
+            if isinstance(value, (list, tuple, set)):
+                value = ",".join(str(v) for v in value)
+            elif isinstance(value, bool):
+                value = str(value).lower()
+            params[name] = value
+        return params
+
+    async def _request(self, path: str, **kwargs):
+        resp = await self.client.get(f"{self.base_url}/{path}", params=self._params(kwargs), timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def get_price(self, ids, vs_currencies, **kwargs):
+        return await self._request("simple/price", ids=ids, vs_currencies=vs_currencies, **kwargs)
+
+    async def get_coins_markets(self, vs_currency, **kwargs):
+        return await self._request("coins/markets", vs_currency=vs_currency, **kwargs)
+
+    async def get_coins_list(self, **kwargs):
+        return await self._request("coins/list", **kwargs)
+
+class CachedCoinGecko:
+    """
+    Обёртка над AsyncCoinGecko с TTL-кэшем на каждый метод.
+    Одинаковые одновременные запросы схлопываются в один вызов (single-flight).
+    Если ответ устарел, но не старше ttl + stale_ttl, отдаём его сразу и обновляем в фоне;
+    при ошибке или 429 отдаём последний известный ответ и делаем паузу error_backoff.
+    """
+
+    def __init__(self, api: AsyncCoinGecko, ttls: dict = None, stale_ttl: float = COINGECKO_STALE_TTL,
+                 error_backoff: float = COINGECKO_ERROR_BACKOFF):
+        self.api = api
+        self.ttls = ttls or COINGECKO_CACHE_TTL
+        self.stale_ttl = stale_ttl
+        self.error_backoff = error_backoff
+        self._entries = {}
+        self._flights = {}  # ключ -> asyncio.Task выполняющегося запроса
+        self._backoff_until = 0.0
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "coalesced": 0, "errors": 0}
+
+    async def get_price(self, **kwargs):
+        return await self._get("get_price", kwargs)
+
+    async def get_coins_markets(self, **kwargs):
+        return await self._get("get_coins_markets", kwargs)
+
+    async def get_coins_list(self, **kwargs):
+        return await self._get("get_coins_list", kwargs)
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["entries"] = len(self._entries)
+        return stats
+
+    @staticmethod
+    def _cache_key(method: str, kwargs: dict) -> tuple:
+        params = []
+        for name, value in sorted(kwargs.items()):
+            if isinstance(value, str):
+                value = value.split(",")
+            if isinstance(value, (list, tuple, set)):
+                value = ",".join(sorted(str(v).strip().lower() for v in value))
+            params.append((name, value))
+        return method, tuple(params)
+
+    async def _get(self, method: str, kwargs: dict):
+        key = self._cache_key(method, kwargs)
+        ttl = self.ttls.get(method, 60)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = now - fetched_at
+            if age < ttl:
+                self._stats["hits"] += 1
+                return value
+            if age < ttl + self.stale_ttl or now < self._backoff_until:
+                self._stats["stale"] += 1
+                if key not in self._flights and now >= self._backoff_until:
+                    self._start_flight(key, method, kwargs)
+                return value
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start_flight(key, method, kwargs)
+            self._stats["misses"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        try:
+            # shield: отмена одного ожидающего не должна отменять запрос для остальных
+            return await asyncio.shield(flight)
+        except Exception:
+            if entry is not None:
+                return entry[0]
+            raise
+
+    def _start_flight(self, key: tuple, method: str, kwargs: dict) -> asyncio.Task:
+        flight = self._flights[key] = asyncio.create_task(self._fetch(key, method, kwargs))
+        # Ошибку фонового обновления уже залогировали в _fetch
+        flight.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return flight
+
+    async def _fetch(self, key: tuple, method: str, kwargs: dict):
+        try:
+            value = await getattr(self.api, method)(**kwargs)
+            self._entries[key] = (value, time.monotonic())
+            return value
+        except Exception as e:
+            self._stats["errors"] += 1
+            self._backoff_until = time.monotonic() + self.error_backoff
+            logger.warning(f"CoinGecko {method} не ответил: {e}")
+            raise
+        finally:
+            del self._flights[key]
+
+# Общий HTTP-клиент с пулом keep-alive соединений для источников новостей и CoinGecko
+HTTP_CLIENT = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+    follow_redirects=True,
+)
+
+cg = CachedCoinGecko(AsyncCoinGecko(HTTP_CLIENT))
 
-# ========== ГЛОБАЛЬНАЯ ПЕРЕМЕННАЯ для списка доступных монет ============
-# Мы заранее загрузим все «id» монет с CoinGecko, чтобы проверять корректность.
-SUPPORTED_COINS = set()
+# ---------------------- Справочник монет ---------------------------------------
 
-def load_supported_coins():
-    """Загружаем список монет (id) с CoinGecko для проверки. Делается один раз при старте."""
-    global SUPPORTED_COINS
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CoinIndex:
+    """
+    Справочник монет CoinGecko: id, тикер и название.
+
+    Точный поиск — словарь «вариант написания -> монеты» (id, id с пробелами вместо
+    дефисов, тикер, название). Если вариант подходит нескольким монетам (тикер "btc"
+    есть у десятков токенов), выбирается самая популярная: выше по капитализации, затем
+    с большим числом подписчиков, затем с самым коротким id. Подсказки при опечатках
+    ищутся по триграммам id и названий: для каждой триграммы хранится массив номеров,
+    совпадения со всеми названиями считаются одним np.bincount.
+
+    Справочник сохраняется в файл и при старте читается оттуда, без обращения к сети.
+    Перестройка собирает новое состояние целиком и подменяет его одним присваиванием.
+    """
+
+    def __init__(self, path: str = COIN_INDEX_FILE):
+        self.path = path
+        self.updated_at = 0.0
+        # Растёт при каждой перестройке (для перестройки зависимых индексов)
+        self.version = 0
+        self._state = self._build([], {})
+
+    @staticmethod
+    def _build(coins: list, ranks: dict) -> dict:
+        """coins — [(id, тикер, название)], ranks — id -> место по капитализации."""
+        info = {}
+        aliases = {}
+        terms, term_coins = [], []
+        for coin_id, symbol, name in coins:
+            coin_id = (coin_id or "").lower()
+            if not coin_id or coin_id in info:
+                continue
+            symbol, name = symbol or "", name or ""
+            info[coin_id] = (symbol, name)
+            for alias in {coin_id, coin_id.replace("-", " "), symbol.lower(), " ".join(name.lower().split())}:
+                if alias:
+                    aliases.setdefault(alias, []).append(coin_id)
+            for term in {coin_id, name.lower()}:
+                if term:
+                    terms.append(term)
+                    term_coins.append(coin_id)
+
+        postings = {}
+        sizes = np.empty(len(terms), dtype=np.int32)
+        for i, term in enumerate(terms):
+            grams = _trigrams(term)
+            sizes[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        return {
+            "coins": coins,
+            "ranks": ranks,
+            "info": info,
+            "aliases": aliases,
+            "term_coins": term_coins,
+            "term_sizes": sizes,
+            "postings": {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()},
+        }
+
+    def __len__(self) -> int:
+        return len(self._state["info"])
+
+    def __contains__(self, coin: str) -> bool:
+        return coin in self._state["info"]
+
+    @property
+    def info(self) -> dict:
+        """id монеты -> (тикер, название)."""
+        return self._state["info"]
+
+    def _popularity(self, coin: str) -> tuple:
+        rank = self._state["ranks"].get(coin, math.inf)
+        return (rank, -subscription_store.user_count(coin), len(coin), coin)
+
+    def resolve(self, text: str):
+        """id монеты по id, тикеру или названию (без учёта регистра); None, если не нашли."""
+        coins = self._state["aliases"].get(" ".join(text.lower().split()))
+        if not coins:
+            return None
+        return coins[0] if len(coins) == 1 else min(coins, key=self._popularity)
+
+    def suggest(self, text: str, limit: int = 3) -> list:
+        """Похожие монеты при опечатке ("etherium" -> ethereum), лучшие первыми."""
+        state = self._state
+        query = " ".join(text.lower().split())
+        grams = _trigrams(query)
+        rows = [state["postings"][g] for g in grams if g in state["postings"]]
+        if not query or not rows:
+            return []
+        hits = np.bincount(np.concatenate(rows), minlength=len(state["term_coins"]))
+        scores = 2 * hits / (state["term_sizes"] + len(grams))
+        k = min(len(scores), limit * 10)
+        top = np.argpartition(-scores, k - 1)[:k]
+        candidates = {}
+        for row in top:
+            score = float(scores[row])
+            coin = state["term_coins"][row]
+            if score >= COIN_SUGGEST_MIN_SCORE and score > candidates.get(coin, 0.0):
+                candidates[coin] = score
+        ranked = sorted(candidates, key=lambda c: (-round(candidates[c], 2), self._popularity(c)))
+        return ranked[:limit]
+
+    def load(self) -> bool:
+        """Читает справочник из файла; False, если файла нет или он повреждён."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            ranks = data.get("ranks", {})
+            # Справочник без капитализации годится только до первого обновления
+            self._replace([tuple(c) for c in data["coins"]], ranks, data["updated_at"] if ranks else 0.0)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать {self.path}: {e}")
+            return False
+        return True
+
+    def _replace(self, coins: list, ranks: dict, updated_at: float):
+        self._state = self._build(coins, ranks)
+        self.updated_at = updated_at
+        self.version += 1
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "updated_at": self.updated_at,
+                "coins": self._state["coins"],
+                "ranks": self._state["ranks"],
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def refresh(self, api, retries: int = COIN_INDEX_RANK_RETRIES,
+                      retry_delay: float = COINGECKO_ERROR_BACKOFF):
+        """
+        Загружает список монет и места по капитализации из CoinGecko и сохраняет на диск.
+        Без капитализации неоднозначные тикеры решаются наугад ("btc" -> batcat), поэтому
+        справочник без неё не строится: если прежней капитализации нет, запрос повторяется,
+        а пока справочник пуст — до успеха.
+        """
+        coin_list = await api.get_coins_list()  # [{'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'}, ...]
+        ranks = self._state["ranks"]
+        attempt = 0
+        while True:
+            try:
+                markets = await api.get_coins_markets(
+                    vs_currency="usd", order="market_cap_desc", per_page=COIN_INDEX_RANKED, page=1,
+                )
+                ranks = {
+                    item["id"]: item.get("market_cap_rank") or position
+                    for position, item in enumerate(markets, 1)
+                }
+                break
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить капитализацию монет: {e}")
+            attempt += 1
+            if ranks or (attempt > retries and len(self)):
+                break
+            await asyncio.sleep(min(retry_delay * 2 ** (attempt - 1), COIN_INDEX_RETRY_MAX_DELAY))
+        if not ranks:
+            logger.warning("Справочник монет не обновлён: нет данных о капитализации.")
+            return
+        coins = [(c["id"], c.get("symbol") or "", c.get("name") or "") for c in coin_list]
+
+        def rebuild():
+            self._replace(coins, ranks, time.time())
+            self._save()
+        await asyncio.to_thread(rebuild)
+
+    def refresh_due_in(self, interval: float) -> float:
+        """Через сколько секунд справочник пора обновлять (0 — уже пора)."""
+        return max(0.0, self.updated_at + interval - time.time())
+
+coin_index = CoinIndex()
+
+async def load_supported_coins():
+    """
+    Обновляем справочник монет из CoinGecko (в фоне, раз в COIN_LIST_REFRESH_INTERVAL).
+    Если запрос не удался, остаётся предыдущий справочник.
+    """
     try:
-        coin_list = cg.get_coins_list()  # [{'id': 'bitcoin', ...}, ...]
-        SUPPORTED_COINS = {coin['id'].lower() for coin in coin_list}
-        logger.info(f"Загружено {len(SUPPORTED_COINS)} монет из CoinGecko для проверки")
+        await coin_index.refresh(cg)
+        logger.info(f"Загружено {len(coin_index)} монет из CoinGecko для проверки")
     except Exception as e:
         logger.error(f"Не удалось загрузить список монет из CoinGecko: {e}")
-        SUPPORTED_COINS = set()  # пусть будет пустое множество в случае ошибки
+
+COIN_INDEX_LOADING_TEXT = "Список монет ещё загружается, попробуйте через минуту."
+
+async def coin_index_ready() -> bool:
+    """
+    Загружен ли справочник монет. Сразу после запуска ждём прогрев (чтение справочника
+    с диска) не дольше COIN_INDEX_WAIT секунд. Без справочника ввод пользователя не
+    проверить, поэтому подписки и оповещения в это время не принимаются.
+    """
+    if not len(coin_index) and _warm_up_task is not None and not _warm_up_task.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(_warm_up_task), COIN_INDEX_WAIT)
+        except Exception:
+            pass
+    return bool(len(coin_index))
+
+def resolve_coin(text: str) -> str:
+    """id монеты по вводу пользователя (id, тикер или название); None — монета не найдена."""
+    return coin_index.resolve(text.strip().lower())
 
 # --------------------------- Проверка подписки на канал ------------------------
-def is_user_in_channel(bot, user_id: int, channel_id: int) -> bool:
+async def is_user_in_channel(bot, user_id: int, channel_id: int) -> bool:
     """
     Возвращает True, если пользователь user_id состоит (или является админом) в канале channel_id.
     При ошибке (бот не админ, канал приватный и т.д.) возвращаем False.
     """
     try:
-        member_info = bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+        member_info = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
         if member_info.status in ["member", "administrator", "creator"]:
             return True
         return False
@@ -85,7 +640,19 @@ def is_user_in_channel(bot, user_id: int, channel_id: int) -> bool:
         logger.warning(f"Ошибка getChatMember для user_id={user_id}: {e}")
         return False
 
-# ---------------------- Функции подписок --------------------------------------
+# ---------------------- Файлы состояния ---------------------------------------
+
+def atomic_write_json(path: str, data):
+    """
+    Пишет JSON во временный файл рядом с path и атомарно подменяет им исходный,
+    чтобы падение посреди записи не оставило битый файл.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 def load_subscriptions() -> dict:
     if not os.path.exists(SUBSCRIPTIONS_FILE):
@@ -97,133 +664,1293 @@ def load_subscriptions() -> dict:
         logger.warning(f"Не удалось прочитать {SUBSCRIPTIONS_FILE}: {e}")
         return {}
 
-def save_subscriptions(subscriptions: dict):
+def load_previous_prices() -> dict:
+    if not os.path.exists(PREVIOUS_PRICES_FILE):
+        return {}
+    try:
+        with open(PREVIOUS_PRICES_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {PREVIOUS_PRICES_FILE}: {e}")
+        return {}
+
+def load_seen_news_file() -> dict:
+    if not os.path.exists(NEWS_STORAGE_FILE):
+        return {}
+    try:
+        with open(NEWS_STORAGE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {NEWS_STORAGE_FILE}: {e}")
+        return {}
+    if not isinstance(data, dict):
+        # Старый формат (один ID последней новости) — начинаем индекс заново
+        logger.info(f"{NEWS_STORAGE_FILE} в старом формате, индекс новостей будет создан заново.")
+        return {}
+    return {k: float(v) for k, v in data.items()}
+
+def load_outbox_file() -> list:
+    if not os.path.exists(OUTBOX_FILE):
+        return []
+    try:
+        with open(OUTBOX_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {OUTBOX_FILE}: {e}")
+        return []
+
+def load_alert_rules_file() -> list:
+    if not os.path.exists(ALERT_RULES_FILE):
+        return []
     try:
-        with open(SUBSCRIPTIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(subscriptions, f, ensure_ascii=False, indent=4)
+        with open(ALERT_RULES_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
     except Exception as e:
-        logger.warning(f"Не удалось записать {SUBSCRIPTIONS_FILE}: {e}")
+        logger.warning(f"Не удалось прочитать {ALERT_RULES_FILE}: {e}")
+        return []
+
+# ---------------------- Хранилище состояния -----------------------------------
+#
+# Хранилище умеет: подписки (user -> монеты), последние цены монет, индекс
+# отправленных новостей, очередь неотправленных сообщений и правила оповещений о ценах.
+# Любой бэкенд реализует одинаковый набор методов.
+
+class JsonStorage:
+    """
+    Старый формат: subscriptions.json, previous_prices.json и last_news_id.dat.
+    Всё держится в памяти, изменённые файлы переписываются целиком пачкой
+    через flush_delay секунд после первого изменения.
+    """
+
+    def __init__(self, flush_delay: float = STORAGE_FLUSH_DELAY):
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_timer = None
+        self._dirty = set()
+        self._subscriptions = {str(u): list(c) for u, c in load_subscriptions().items()}
+        self._prices = load_previous_prices()
+        self._seen_news = load_seen_news_file()
+        self._outbox = {int(r["id"]): r for r in load_outbox_file()}
+        self._outbox_next_id = max(self._outbox, default=0) + 1
+        self._alert_rules = {
+            (r["chat_id"], r["coin"], r["window"]): r for r in load_alert_rules_file()
+        }
+        # Вопросы, на которые бот ждёт ответа: только в памяти, этот backend — один процесс
+        self._awaiting_replies = {}
+
+    def load_subscriptions(self) -> dict:
+        with self._lock:
+            return {u: list(c) for u, c in self._subscriptions.items()}
+
+    def add_subscription(self, user_id: str, coin: str):
+        with self._lock:
+            coins = self._subscriptions.setdefault(user_id, [])
+            if coin not in coins:
+                coins.append(coin)
+                self._mark_dirty("subscriptions")
+
+    def remove_subscription(self, user_id: str, coin: str):
+        with self._lock:
+            coins = self._subscriptions.get(user_id, [])
+            if coin in coins:
+                coins.remove(coin)
+                self._mark_dirty("subscriptions")
+
+    def load_prices(self) -> dict:
+        with self._lock:
+            return dict(self._prices)
+
+    def save_prices(self, prices: dict):
+        with self._lock:
+            self._prices.update(prices)
+            self._mark_dirty("prices")
+
+    def load_seen_news(self) -> dict:
+        with self._lock:
+            return dict(self._seen_news)
+
+    def save_seen_news(self, added: dict, removed):
+        with self._lock:
+            self._seen_news.update(added)
+            for key in removed:
+                self._seen_news.pop(key, None)
+            self._mark_dirty("seen_news")
+
+    def subscriptions_version(self) -> int:
+        # Файлы меняет только этот процесс
+        return 0
+
+    def load_outbox(self, after_id: int = 0) -> list:
+        with self._lock:
+            return [dict(r) for k, r in sorted(self._outbox.items()) if k > after_id]
+
+    def add_outbox(self, chat_id: str, text: str, parse_mode, created_at: float) -> int:
+        with self._lock:
+            msg_id = self._outbox_next_id
+            self._outbox_next_id += 1
+            self._outbox[msg_id] = {
+                "id": msg_id, "chat_id": chat_id, "text": text,
+                "parse_mode": parse_mode, "created_at": created_at,
+            }
+            self._mark_dirty("outbox")
+        return msg_id
+
+    def remove_outbox(self, msg_id: int):
+        with self._lock:
+            if self._outbox.pop(msg_id, None) is not None:
+                self._mark_dirty("outbox")
+
+    def load_alert_rules(self) -> list:
+        with self._lock:
+            return [dict(r) for r in self._alert_rules.values()]
+
+    def alert_rules_version(self) -> int:
+        return 0
+
+    def save_alert_rule(self, rule: dict):
+        with self._lock:
+            self._alert_rules[(rule["chat_id"], rule["coin"], rule["window"])] = dict(rule)
+            self._mark_dirty("alert_rules")
+
+    def remove_alert_rules(self, chat_id: str, coin: str, window: str = None):
+        with self._lock:
+            for key in [k for k in self._alert_rules if k[:2] == (chat_id, coin) and window in (None, k[2])]:
+                del self._alert_rules[key]
+            self._mark_dirty("alert_rules")
+
+    def save_alert_states(self, states: list):
+        with self._lock:
+            for state in states:
+                rule = self._alert_rules.get((state["chat_id"], state["coin"], state["window"]))
+                if rule is not None:
+                    rule.update(state)
+            self._mark_dirty("alert_rules")
+
+    def load_awaiting_reply(self, user_id: str):
+        with self._lock:
+            return self._awaiting_replies.get(user_id)
+
+    def save_awaiting_reply(self, user_id: str, prompt: str = None):
+        with self._lock:
+            if prompt is None:
+                self._awaiting_replies.pop(user_id, None)
+            else:
+                self._awaiting_replies[user_id] = prompt
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return True
+
+    def release_lease(self, name: str, owner: str):
+        pass
+
+    def _mark_dirty(self, name: str):
+        self._dirty.add(name)
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            dirty, self._dirty = self._dirty, set()
+            snapshots = {}
+            if "subscriptions" in dirty:
+                snapshots[SUBSCRIPTIONS_FILE] = {u: list(c) for u, c in self._subscriptions.items() if c}
+            if "prices" in dirty:
+                snapshots[PREVIOUS_PRICES_FILE] = dict(self._prices)
+            if "seen_news" in dirty:
+                snapshots[NEWS_STORAGE_FILE] = dict(self._seen_news)
+            if "outbox" in dirty:
+                snapshots[OUTBOX_FILE] = [self._outbox[k] for k in sorted(self._outbox)]
+            if "alert_rules" in dirty:
+                snapshots[ALERT_RULES_FILE] = [dict(r) for r in self._alert_rules.values()]
+        with self._write_lock:
+            for path, data in snapshots.items():
+                try:
+                    atomic_write_json(path, data)
+                except Exception as e:
+                    logger.warning(f"Не удалось записать {path}: {e}")
+
+    def close(self):
+        self.flush()
+
+class SqliteStorage:
+    """
+    SQLite в режиме WAL: каждое изменение — одна короткая транзакция,
+    запросы параметризованы (sqlite3 кэширует подготовленные выражения).
+    Одно соединение на процесс, записи из разных потоков сериализуются локом.
+    Методы синхронные: записи из цикла событий идут через asyncio.to_thread, поэтому
+    ожидание чужой блокировки базы (до busy_timeout) не останавливает бота. Чтения в
+    WAL блокировку не ждут и остаются в цикле.
+    Базу могут делить несколько воркеров: изменения подписок и правил оповещений
+    отмечаются счётчиками в meta, таблица leases даёт аренду периодических задач
+    одному воркеру, а awaiting_replies хранит вопросы, на которые бот ждёт ответа
+    (ответ может прийти на другой воркер).
+    При первом запуске один раз переносит данные из старых JSON-файлов.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id TEXT NOT NULL,
+            coin TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (user_id, coin)
+        );
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_coin ON subscriptions (coin);
+
+        CREATE TABLE IF NOT EXISTS prices (
+            coin TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS seen_news (
+            key TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_seen_news_seen_at ON seen_news (seen_at);
+
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            created_at REAL NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS awaiting_replies (
+            user_id TEXT PRIMARY KEY,
+            prompt TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            chat_id TEXT NOT NULL,
+            coin TEXT NOT NULL,
+            time_window TEXT NOT NULL,
+            threshold REAL NOT NULL,
+            ref_price REAL,
+            last_fired_at REAL NOT NULL DEFAULT 0,
+            armed INTEGER NOT NULL DEFAULT 1,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, coin, time_window)
+        );
+    """
+
+    def __init__(self, path: str = STORAGE_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=128,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate_from_json()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _migrate_from_json(self):
+        if self._query("SELECT 1 FROM meta WHERE key = 'json_migrated'"):
+            return
+        subscriptions = load_subscriptions()
+        prices = load_previous_prices()
+        seen_news = load_seen_news_file()
+        now = time.time()
+        with self._transaction() as conn:
+            # Воркеры, запущенные одновременно, проверяют отметку ещё раз уже под блокировкой
+            # записи: перенос выполняет только первый
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return
+            conn.executemany(
+                "INSERT OR IGNORE INTO subscriptions (user_id, coin, created_at) VALUES (?, ?, ?)",
+                [(str(u), c, now) for u, coins in subscriptions.items() for c in coins],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO prices (coin, price, updated_at) VALUES (?, ?, ?)",
+                [(c, float(p), now) for c, p in prices.items()],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO seen_news (key, seen_at) VALUES (?, ?)",
+                list(seen_news.items()),
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(now),))
+        logger.info(
+            f"Перенос из JSON в {self.path}: подписок {len(subscriptions)}, "
+            f"цен {len(prices)}, ключей новостей {len(seen_news)}."
+        )
+
+    def load_subscriptions(self) -> dict:
+        subscriptions = {}
+        for user_id, coin in self._query("SELECT user_id, coin FROM subscriptions ORDER BY rowid"):
+            subscriptions.setdefault(user_id, []).append(coin)
+        return subscriptions
+
+    def add_subscription(self, user_id: str, coin: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (user_id, coin, created_at) VALUES (?, ?, ?)",
+                (user_id, coin, time.time()),
+            )
+            return self._bump_version(conn, "subscriptions_version")
+
+    def remove_subscription(self, user_id: str, coin: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM subscriptions WHERE user_id = ? AND coin = ?", (user_id, coin))
+            return self._bump_version(conn, "subscriptions_version")
+
+    @staticmethod
+    def _bump_version(conn, key: str) -> int:
+        """Отмечает изменение данных для других воркеров; возвращает новую версию."""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (key,),
+        )
+        return int(conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0])
+
+    def _version(self, key: str) -> int:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return int(rows[0][0]) if rows else 0
+
+    def subscriptions_version(self) -> int:
+        return self._version("subscriptions_version")
+
+    def load_prices(self) -> dict:
+        return dict(self._query("SELECT coin, price FROM prices"))
+
+    def save_prices(self, prices: dict):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO prices (coin, price, updated_at) VALUES (?, ?, ?)",
+                [(c, float(p), now) for c, p in prices.items()],
+            )
+
+    def load_seen_news(self) -> dict:
+        return dict(self._query("SELECT key, seen_at FROM seen_news"))
+
+    def save_seen_news(self, added: dict, removed):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO seen_news (key, seen_at) VALUES (?, ?)",
+                list(added.items()),
+            )
+            conn.executemany("DELETE FROM seen_news WHERE key = ?", [(k,) for k in removed])
+
+    def load_outbox(self, after_id: int = 0) -> list:
+        rows = self._query(
+            "SELECT id, chat_id, text, parse_mode, created_at FROM outbox WHERE id > ? ORDER BY id",
+            (after_id,),
+        )
+        return [
+            {"id": r[0], "chat_id": r[1], "text": r[2], "parse_mode": r[3], "created_at": r[4]}
+            for r in rows
+        ]
+
+    def add_outbox(self, chat_id: str, text: str, parse_mode, created_at: float) -> int:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (chat_id, text, parse_mode, created_at) VALUES (?, ?, ?, ?)",
+                (chat_id, text, parse_mode, created_at),
+            )
+            return cursor.lastrowid
+
+    def remove_outbox(self, msg_id: int):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM outbox WHERE id = ?", (msg_id,))
+
+    def load_alert_rules(self) -> list:
+        rows = self._query(
+            "SELECT chat_id, coin, time_window, threshold, ref_price, last_fired_at, armed "
+            "FROM alert_rules ORDER BY rowid"
+        )
+        return [
+            {"chat_id": r[0], "coin": r[1], "window": r[2], "threshold": r[3],
+             "ref_price": r[4], "last_fired_at": r[5], "armed": bool(r[6])}
+            for r in rows
+        ]
+
+    def alert_rules_version(self) -> int:
+        return self._version("alert_rules_version")
+
+    def save_alert_rule(self, rule: dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO alert_rules "
+                "(chat_id, coin, time_window, threshold, ref_price, last_fired_at, armed, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (rule["chat_id"], rule["coin"], rule["window"], rule["threshold"], rule.get("ref_price"),
+                 rule.get("last_fired_at", 0.0), int(rule.get("armed", True)), time.time()),
+            )
+            return self._bump_version(conn, "alert_rules_version")
+
+    def remove_alert_rules(self, chat_id: str, coin: str, window: str = None):
+        with self._transaction() as conn:
+            if window is None:
+                conn.execute("DELETE FROM alert_rules WHERE chat_id = ? AND coin = ?", (chat_id, coin))
+            else:
+                conn.execute(
+                    "DELETE FROM alert_rules WHERE chat_id = ? AND coin = ? AND time_window = ?",
+                    (chat_id, coin, window),
+                )
+            return self._bump_version(conn, "alert_rules_version")
+
+    def save_alert_states(self, states: list):
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE alert_rules SET ref_price = ?, last_fired_at = ?, armed = ? "
+                "WHERE chat_id = ? AND coin = ? AND time_window = ?",
+                [(s["ref_price"], s["last_fired_at"], int(s["armed"]), s["chat_id"], s["coin"], s["window"])
+                 for s in states],
+            )
+            return self._bump_version(conn, "alert_rules_version")
+
+    def load_awaiting_reply(self, user_id: str):
+        rows = self._query("SELECT prompt FROM awaiting_replies WHERE user_id = ?", (user_id,))
+        return rows[0][0] if rows else None
+
+    def save_awaiting_reply(self, user_id: str, prompt: str = None):
+        with self._transaction() as conn:
+            if prompt is None:
+                conn.execute("DELETE FROM awaiting_replies WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO awaiting_replies (user_id, prompt, updated_at) VALUES (?, ?, ?)",
+                    (user_id, prompt, time.time()),
+                )
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Берёт или продлевает аренду name на ttl секунд; False, если её держит другой воркер."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, owner, now + ttl),
+            )
+            return True
+
+    def release_lease(self, name: str, owner: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_storage():
+    if STORAGE_BACKEND == "json":
+        if WORKER_COUNT > 1:
+            logger.error("Для нескольких воркеров нужно общее хранилище SQLite (STORAGE_BACKEND=sqlite). Выход.")
+            exit(1)
+        logger.info("Хранилище состояния: JSON-файлы.")
+        return JsonStorage()
+    logger.info(f"Хранилище состояния: SQLite ({STORAGE_DB_FILE}).")
+    return SqliteStorage(STORAGE_DB_FILE)
+
+storage = create_storage()
+atexit.register(storage.close)
+
+# ---------------------- Функции подписок --------------------------------------
+
+class SubscriptionStore:
+    """
+    Подписки в памяти: прямой индекс (user -> монеты) и обратный (монета -> users).
+    Данные читаются из хранилища при старте, каждое изменение сразу уходит в хранилище.
+    Изменения других воркеров подхватывает reload_if_changed().
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._by_user = {}
+        self._by_coin = {}
+        # Растёт при каждом изменении набора монет (для перестройки зависимых индексов)
+        self.coins_version = 0
+        self._load()
+        logger.info(f"Загружены подписки {len(self._by_user)} пользователей.")
+
+    def _load(self):
+        self._backend_version = self.backend.subscriptions_version()
+        self._by_user = {}
+        self._by_coin = {}
+        for user_id, coins in self.backend.load_subscriptions().items():
+            for coin in coins:
+                self._add(str(user_id), coin)
+
+    def reload_if_changed(self) -> bool:
+        with self._lock:
+            if self.backend.subscriptions_version() == self._backend_version:
+                return False
+            self._load()
+            self.coins_version += 1
+        return True
+
+    def _add(self, user_id: str, coin: str) -> bool:
+        user_coins = self._by_user.setdefault(user_id, [])
+        if coin in user_coins:
+            return False
+        user_coins.append(coin)
+        users = self._by_coin.setdefault(coin, set())
+        if not users:
+            self.coins_version += 1
+        users.add(user_id)
+        return True
+
+    def get(self, user_id: str) -> list:
+        with self._lock:
+            return list(self._by_user.get(user_id, []))
+
+    def users_for(self, coin: str) -> set:
+        with self._lock:
+            return set(self._by_coin.get(coin, ()))
+
+    def user_count(self, coin: str) -> int:
+        with self._lock:
+            return len(self._by_coin.get(coin, ()))
+
+    def all_coins(self) -> set:
+        with self._lock:
+            return set(self._by_coin)
+
+    def add(self, user_id: str, coin: str) -> bool:
+        with self._lock:
+            added = self._add(user_id, coin)
+            if added:
+                self._note_version(self.backend.add_subscription(user_id, coin))
+        return added
+
+    def remove(self, user_id: str, coin: str) -> bool:
+        with self._lock:
+            user_coins = self._by_user.get(user_id)
+            if not user_coins or coin not in user_coins:
+                return False
+            user_coins.remove(coin)
+            users = self._by_coin.get(coin)
+            users.discard(user_id)
+            if not users:
+                del self._by_coin[coin]
+                self.coins_version += 1
+            self._note_version(self.backend.remove_subscription(user_id, coin))
+        return True
+
+    def _note_version(self, version):
+        # Своё изменение не требует перечитывать подписки, если между ним и прошлой
+        # синхронизацией никто другой ничего не менял
+        if version is not None and version == self._backend_version + 1:
+            self._backend_version = version
+
+subscription_store = SubscriptionStore(storage)
 
 def add_subscription(user_id: str, subscription: str) -> bool:
     """
     Добавляет криптовалюту (subscription) к подпискам пользователя.
     Возвращает True, если добавили новую подписку, False — если такая уже была
     """
-    subscriptions = load_subscriptions()
-    user_subs = subscriptions.setdefault(user_id, [])
-
-    if subscription in user_subs:
+    if not subscription_store.add(user_id, subscription):
         return False
-
-    user_subs.append(subscription)
-    save_subscriptions(subscriptions)
     logger.info(f"Пользователь {user_id} подписался на '{subscription}'.")
     return True
 
 def remove_subscription(user_id: str, subscription: str) -> bool:
-    subscriptions = load_subscriptions()
-    if user_id in subscriptions and subscription in subscriptions[user_id]:
-        subscriptions[user_id].remove(subscription)
-        save_subscriptions(subscriptions)
+    if subscription_store.remove(user_id, subscription):
         logger.info(f"Пользователь {user_id} отписался от '{subscription}'.")
         return True
     return False
 
 def get_user_subscriptions(user_id: str) -> list:
-    subscriptions = load_subscriptions()
-    return subscriptions.get(user_id, [])
+    return subscription_store.get(user_id)
 
-# ---------------------- Получение новостей ------------------------------------
+async def set_awaiting_reply(user_id: str, prompt: str = None):
+    """
+    Запоминает вопрос, на который бот ждёт ответа ("subscribe", "unsubscribe",
+    "channel_subscribe"); None — ответа больше не ждём. Хранится в storage, а не в
+    context.user_data: при нескольких воркерах ответ может прийти на другой воркер.
+    """
+    await asyncio.to_thread(storage.save_awaiting_reply, user_id, prompt)
 
-def fetch_cryptopanic_news() -> list:
-    if not CRYPTOPANIC_API_KEY:
-        logger.warning("CRYPTOPANIC_API_KEY не задан.")
-        return []
-    base_url = "https://cryptopanic.com/api/v1/posts/"
-    params = {
-        "auth_token": CRYPTOPANIC_API_KEY,
-        "filter": "rising",
-        "kind": "news",
-    }
+async def get_awaiting_reply(user_id: str):
+    return await asyncio.to_thread(storage.load_awaiting_reply, user_id)
+
+# ---------------------- Модель новости ----------------------------------------
+
+# Параметры ссылок, которые не влияют на содержимое (метки рекламных кампаний)
+TRACKING_QUERY_PARAMS = {"ref", "source", "fbclid", "gclid", "mc_cid", "mc_eid"}
+
+def _clean_query(query: str) -> list:
+    return sorted(
+        (k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_QUERY_PARAMS
+    )
+
+def canonical_url(url: str) -> str:
+    """Ссылка для показа: без якоря и utm-меток, хост в нижнем регистре."""
     try:
-        resp = requests.get(base_url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        results = data.get("results", [])
-        logger.info(f"Получено {len(results)} новостей из CryptoPanic.")
-        return results
-    except Exception as e:
-        logger.warning(f"Ошибка при запросе CryptoPanic: {e}")
-        return []
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(_clean_query(parts.query)), ""))
 
-def fetch_newsapi_news() -> list:
-    if not NEWSAPI_API_KEY:
-        logger.warning("NEWSAPI_API_KEY не задан.")
-        return []
-    base_url = "https://newsapi.org/v2/everything"
-    params = {
-        "q": "cryptocurrency OR bitcoin OR ethereum",
-        "apiKey": NEWSAPI_API_KEY,
-        "language": "en",
-        "sortBy": "publishedAt",
-        "pageSize": 50
-    }
+def normalize_url(url: str) -> str:
+    """Ключ ссылки для дедупликации: без схемы, www, якоря, utm-меток и завершающего '/'."""
     try:
-        resp = requests.get(base_url, params=params, timeout=10)
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip().lower()
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = _clean_query(parts.query)
+    normalized = host + parts.path.rstrip("/")
+    if query:
+        normalized += "?" + urlencode(query)
+    return normalized
+
+def news_title_hash(title: str) -> str:
+    normalized = " ".join(re.findall(r"\w+", title.lower()))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+def parse_news_timestamp(value) -> float:
+    """ISO-строка (API) или time.struct_time (feedparser) -> unix-время; 0.0, если не разобрать."""
+    if not value:
+        return 0.0
+    if isinstance(value, time.struct_time):
+        return float(calendar.timegm(value))
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+class NewsItem:
+    """
+    Новость в едином виде для всех источников. Разбирается один раз при получении;
+    монеты и тональность проставляет annotate_news(), sources (все источники, где
+    встретилась история) — cluster_news().
+    """
+    __slots__ = (
+        "id", "url", "title", "source", "published", "title_hash", "coins", "sentiment",
+        "sources", "signature",
+    )
+
+    def __init__(self, title: str, url: str = "", guid: str = "", source: str = "", published: float = 0.0):
+        self.title = " ".join(title.split())
+        self.url = canonical_url(url) if url else ""
+        self.title_hash = news_title_hash(self.title)
+        if url:
+            self.id = "u:" + normalize_url(url)
+        elif guid:
+            self.id = "g:" + guid
+        else:
+            self.id = "t:" + self.title_hash
+        self.source = source
+        self.published = published
+        self.coins = frozenset()
+        self.sentiment = "NEUTRAL"
+        self.sources = frozenset([source]) if source else frozenset()
+        self.signature = None
+
+    def copy(self) -> "NewsItem":
+        item = object.__new__(NewsItem)
+        for name in self.__slots__:
+            setattr(item, name, getattr(self, name))
+        return item
+
+    def __repr__(self):
+        return f"NewsItem({self.source}: {self.title!r})"
+
+def news_item_from_cryptopanic(post: dict, source: str = "CryptoPanic"):
+    title = post.get("title") or ""
+    if not title.strip():
+        return None
+    return NewsItem(
+        title,
+        url=post.get("url") or "",
+        guid=str(post.get("id") or ""),
+        source=source,
+        published=parse_news_timestamp(post.get("published_at")),
+    )
+
+def news_item_from_newsapi(article: dict, source: str = "NewsAPI"):
+    title = article.get("title") or ""
+    if not title.strip():
+        return None
+    return NewsItem(
+        title,
+        url=article.get("url") or "",
+        source=source,
+        published=parse_news_timestamp(article.get("publishedAt")),
+    )
+
+def news_item_from_rss(entry, source: str):
+    title = entry.get("title") or ""
+    if not title.strip():
+        return None
+    return NewsItem(
+        title,
+        url=entry.get("link") or "",
+        guid=entry.get("id") or "",
+        source=source,
+        published=parse_news_timestamp(entry.get("published_parsed") or entry.get("updated_parsed")),
+    )
+
+def normalize_news(raw_items, converter, *args) -> list:
+    items = []
+    for raw in raw_items:
+        item = converter(raw, *args)
+        if item is not None:
+            items.append(item)
+    return items
+
+def annotate_news(items: list) -> list:
+    """Проставляет новостям упомянутые монеты и тональность (тональность — одной пачкой)."""
+    matcher = get_coin_matcher()
+    for item in items:
+        item.coins = frozenset(matcher.match(item.title))
+    labels = sentiment_service.label_many([item.title for item in items])
+    for item, label in zip(items, labels):
+        item.sentiment = label
+    return items
+
+# ---------------------- Склейка похожих новостей -------------------------------
+
+# Коэффициенты хэш-функций MinHash: h(x) = (a * x + b) mod p. Seed фиксирован,
+# чтобы подписи одного заголовка совпадали между запусками
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240101)
+_MINHASH_PARAMS = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+    for _ in range(NEWS_MINHASH_PERMUTATIONS)
+]
+
+def title_shingles(title: str, size: int = NEWS_SHINGLE_SIZE) -> set:
+    """Символьные шинглы нормализованного заголовка (регистр и пунктуация не важны)."""
+    normalized = " ".join(re.findall(r"\w+", title.lower()))
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+def news_signature(item: NewsItem) -> tuple:
+    """MinHash-подпись заголовка; считается один раз и запоминается в item."""
+    if item.signature is None:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+            for s in title_shingles(item.title)
+        ]
+        item.signature = tuple(
+            min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PARAMS
+        )
+    return item.signature
+
+def signature_similarity(sig1: tuple, sig2: tuple) -> float:
+    """Оценка сходства Жаккара по двум MinHash-подписям."""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+class NewsCluster:
+    """Одна история: первая новость (представитель) и все источники, где она встретилась."""
+    __slots__ = ("representative", "sources", "created_at", "band_keys")
+
+    def __init__(self, representative: NewsItem, created_at: float, band_keys: list):
+        self.representative = representative
+        self.sources = set(representative.sources)
+        self.created_at = created_at
+        self.band_keys = band_keys
+
+class NewsClusterIndex:
+    """
+    LSH-индекс историй. Подпись делится на bands полос; новости, у которых совпала хотя бы
+    одна полоса, становятся кандидатами и сравниваются по оценке сходства. Так похожий
+    заголовок находится без сравнения со всеми остальными. Истории старше ttl забываются
+    (ttl=None — хранить всё, для склейки одной пачки).
+    """
+
+    def __init__(self, ttl: float = None, bands: int = NEWS_LSH_BANDS,
+                 threshold: float = NEWS_CLUSTER_THRESHOLD):
+        self.ttl = ttl
+        self.bands = bands
+        self.threshold = threshold
+        self._rows = NEWS_MINHASH_PERMUTATIONS // bands
+        self._clusters = OrderedDict()  # id -> NewsCluster в порядке создания
+        self._buckets = {}              # (полоса, значения) -> [id кластера]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"clusters": 0, "merged": 0}
+
+    def _band_keys(self, signature: tuple) -> list:
+        rows = self._rows
+        return [(i, signature[i * rows:(i + 1) * rows]) for i in range(self.bands)]
+
+    def _evict(self, now: float):
+        cutoff = now - self.ttl
+        while self._clusters:
+            cluster_id, cluster = next(iter(self._clusters.items()))
+            if cluster.created_at >= cutoff:
+                break
+            del self._clusters[cluster_id]
+            for key in cluster.band_keys:
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.remove(cluster_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def add(self, item: NewsItem) -> NewsCluster:
+        """Кластер, в который попала новость; если похожих нет — новый, с item во главе."""
+        signature = news_signature(item)
+        band_keys = self._band_keys(signature)
+        now = time.time()
+        with self._lock:
+            if self.ttl is not None:
+                self._evict(now)
+            candidates = []
+            for key in band_keys:
+                for cluster_id in self._buckets.get(key, ()):
+                    if cluster_id not in candidates:
+                        candidates.append(cluster_id)
+            for cluster_id in sorted(candidates):
+                cluster = self._clusters[cluster_id]
+                if signature_similarity(signature, news_signature(cluster.representative)) >= self.threshold:
+                    cluster.sources |= item.sources
+                    self._stats["merged"] += 1
+                    return cluster
+
+            cluster_id = self._next_id
+            self._next_id += 1
+            cluster = self._clusters[cluster_id] = NewsCluster(item, now, band_keys)
+            for key in band_keys:
+                self._buckets.setdefault(key, []).append(cluster_id)
+            self._stats["clusters"] += 1
+            return cluster
+
+    def filter_new(self, items: list) -> list:
+        """Новости, которые начали новую историю; остальные — поздние дубликаты уже известных."""
+        return [item for item in items if self.add(item).representative is item]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active"] = len(self._clusters)
+        return stats
+
+def cluster_news(items: list) -> list:
+    """
+    Склеивает похожие новости пачки в истории. Возвращает по одной новости на историю
+    (первую по порядку источников) с объединённым набором источников в item.sources.
+    """
+    index = NewsClusterIndex()
+    clusters = []
+    for item in items:
+        cluster = index.add(item)
+        if cluster.representative is item:
+            clusters.append(cluster)
+    for cluster in clusters:
+        cluster.representative.sources = frozenset(cluster.sources)
+    return [cluster.representative for cluster in clusters]
+
+def prepare_news(items: list) -> list:
+    """Склеивает пачку в истории и размечает только их представителей."""
+    return annotate_news(cluster_news(items))
+
+# Истории, уже разосланные по расписанию: поздний пересказ той же новости другим
+# источником не уходит повторно
+story_index = NewsClusterIndex(ttl=NEWS_CLUSTER_TTL)
+
+# ---------------------- Получение новостей ------------------------------------
+
+class ConditionalFetcher:
+    """
+    Условные HTTP-запросы к источникам: запоминает ETag / Last-Modified и разобранные
+    новости последнего ответа. Если сервер ответил 304 Not Modified, ничего не парсим
+    и возвращаем сохранённый результат. Наружу отдаются копии: склейка и разметка
+    меняют новости, а сохранённые должны остаться такими, как их разобрали.
+    """
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self._state = {}  # источник -> (etag, last_modified, items)
+        self._stats = {"modified": 0, "not_modified": 0}
+
+    async def fetch(self, source: str, url: str, parse, params: dict = None,
+                    timeout: float = NEWS_SOURCE_TIMEOUT) -> list:
+        state = self._state.get(source)
+        headers = {}
+        if state:
+            etag, last_modified, _ = state
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        resp = await self.client.get(url, params=params, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and state:
+            self._stats["not_modified"] += 1
+            logger.info(f"{source}: без изменений (304).")
+            return [item.copy() for item in state[2]]
         resp.raise_for_status()
-        data = resp.json()
-        articles = data.get("articles", [])
-        logger.info(f"Получено {len(articles)} статей из NewsAPI.")
-        return articles
-    except Exception as e:
-        logger.warning(f"Ошибка при запросе NewsAPI: {e}")
-        return []
 
-def fetch_coindesk_news() -> list:
-    feed_url = "https://feeds.feedburner.com/CoinDesk"
+        items = parse(resp)
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        self._stats["modified"] += 1
+        if etag or last_modified:
+            self._state[source] = (etag, last_modified, items)
+            return [item.copy() for item in items]
+        self._state.pop(source, None)
+        return items
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+news_fetcher = ConditionalFetcher(HTTP_CLIENT)
+
+# Парсеры ответов: имя -> функция (response, имя источника) -> [NewsItem]
+NEWS_PARSERS = {}
+
+def register_news_parser(name: str):
+    def decorator(func):
+        NEWS_PARSERS[name] = func
+        return func
+    return decorator
+
+@register_news_parser("rss")
+def parse_rss_response(resp, source: str) -> list:
+    return normalize_news(feedparser.parse(resp.content).entries, news_item_from_rss, source)
+
+@register_news_parser("cryptopanic")
+def parse_cryptopanic_response(resp, source: str) -> list:
+    return normalize_news(resp.json().get("results", []), news_item_from_cryptopanic, source)
+
+@register_news_parser("newsapi")
+def parse_newsapi_response(resp, source: str) -> list:
+    return normalize_news(resp.json().get("articles", []), news_item_from_newsapi, source)
+
+class NewsSource:
+    """
+    Источник новостей из NEWS_SOURCES_FILE. Поля конфигурации:
+    name, type ("rss" или "json"), url, params, auth_env/auth_param (ключ API
+    из переменной окружения и имя параметра запроса), poll_interval, timeout,
+    parser (для rss по умолчанию "rss"), enabled.
+    min_poll_interval/max_poll_interval — границы адаптивного интервала опроса
+    (по умолчанию poll_interval / 4 и poll_interval * 4).
+    Одновременные fetch() одного источника ждут общий запрос, а не шлют свои.
+    Собирает статистику: задержка последнего запроса, число новостей и ошибок.
+    """
+
+    def __init__(self, config: dict):
+        self.name = config["name"]
+        self.type = config.get("type", "rss")
+        self.url = config["url"]
+        self.params = dict(config.get("params", {}))
+        self.auth_env = config.get("auth_env")
+        self.auth_param = config.get("auth_param")
+        self.poll_interval = float(config.get("poll_interval", NEWS_SOURCE_POLL_INTERVAL))
+        self.min_poll_interval = float(config.get("min_poll_interval", self.poll_interval / 4))
+        self.max_poll_interval = float(config.get("max_poll_interval", self.poll_interval * 4))
+        self.timeout = float(config.get("timeout", NEWS_SOURCE_TIMEOUT))
+        self.parser_name = config.get("parser", "rss" if self.type == "rss" else None)
+        self.enabled = config.get("enabled", True)
+        if self.parser_name not in NEWS_PARSERS:
+            raise ValueError(f"неизвестный парсер {self.parser_name!r}")
+        self._inflight = None
+        self.stats = {"fetches": 0, "errors": 0, "items": 0, "last_items": 0, "last_latency": None}
+
+    async def fetch(self, raise_errors: bool = False) -> list:
+        """Новости источника; ошибка запроса даёт пустой список или, с raise_errors, исключение."""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._fetch_once())
+        # Отмена одного ожидающего (например, по таймауту) не должна обрывать общий запрос
+        items, error = await asyncio.shield(self._inflight)
+        if error is not None and raise_errors:
+            raise error
+        # Каждый вызывающий получает свои копии: склейка и разметка меняют новости
+        return [item.copy() for item in items]
+
+    async def _fetch_once(self) -> tuple:
+        """Один запрос к источнику: (новости, ошибка или None)."""
+        params = dict(self.params)
+        if self.auth_env:
+            key = os.getenv(self.auth_env, "")
+            if not key:
+                logger.warning(f"{self.auth_env} не задан, источник {self.name} пропущен.")
+                return [], None
+            params[self.auth_param] = key
+
+        started = time.monotonic()
+        try:
+            items = await news_fetcher.fetch(
+                self.name, self.url,
+                lambda resp: NEWS_PARSERS[self.parser_name](resp, self.name),
+                params=params or None, timeout=self.timeout,
+            )
+            error = None
+        except Exception as e:
+            logger.warning(f"Ошибка при запросе {self.name}: {e}")
+            items, error = [], e
+
+        latency = time.monotonic() - started
+        self.stats["fetches"] += 1
+        self.stats["errors"] += int(error is not None)
+        self.stats["items"] += len(items)
+        self.stats["last_items"] = len(items)
+        self.stats["last_latency"] = round(latency, 3)
+        if error is None:
+            logger.info(f"Получено {len(items)} новостей из {self.name} за {latency:.2f} с.")
+        return items, error
+
+def load_news_sources() -> list:
+    if not os.path.exists(NEWS_SOURCES_FILE):
+        logger.error(f"Файл источников {NEWS_SOURCES_FILE} не найден, новости получать неоткуда.")
+        return []
     try:
-        feed = feedparser.parse(feed_url)
-        entries = feed.entries
-        logger.info(f"Получено {len(entries)} новостей из CoinDesk RSS.")
-        return entries
+        with open(NEWS_SOURCES_FILE, "r", encoding="utf-8") as f:
+            configs = json.load(f)
     except Exception as e:
-        logger.warning(f"Ошибка при запросе CoinDesk RSS: {e}")
+        logger.error(f"Не удалось прочитать {NEWS_SOURCES_FILE}: {e}")
         return []
 
-def fetch_cointelegraph_news() -> list:
-    feed_url = "https://cointelegraph.com/rss"
+    sources = []
+    for config in configs:
+        try:
+            source = NewsSource(config)
+        except (KeyError, ValueError) as e:
+            logger.warning(f"Источник {config.get('name', '?')} пропущен: {e}")
+            continue
+        if source.enabled:
+            sources.append(source)
+    logger.info(f"Источники новостей: {', '.join(s.name for s in sources) or 'нет'}.")
+    return sources
+
+# Источники в порядке, в котором их новости попадают в общий список
+NEWS_SOURCES = load_news_sources()
+
+def news_source_stats() -> dict:
+    return {source.name: dict(source.stats) for source in NEWS_SOURCES}
+
+async def _fetch_source(source: NewsSource) -> list:
     try:
-        feed = feedparser.parse(feed_url)
-        entries = feed.entries
-        logger.info(f"Получено {len(entries)} новостей из CoinTelegraph RSS.")
-        return entries
-    except Exception as e:
-        logger.warning(f"Ошибка при запросе CoinTelegraph RSS: {e}")
+        return await asyncio.wait_for(source.fetch(), timeout=min(source.timeout, NEWS_FETCH_DEADLINE))
+    except asyncio.TimeoutError:
+        logger.warning(f"Источник {source.name} не ответил вовремя, пропускаем.")
         return []
 
-def fetch_all_news() -> list:
+_all_news_task = None
+
+async def fetch_all_news() -> list:
+    """
+    Опрашивает все источники параллельно. Каждый источник ограничен своим таймаутом
+    и общим дедлайном NEWS_FETCH_DEADLINE; не успевшие источники пропускаются.
+    Возвращает по NewsItem на историю с уже проставленными монетами и тональностью.
+    Одновременные вызовы получают один и тот же список — менять его нельзя.
+    """
+    global _all_news_task
+    if _all_news_task is None or _all_news_task.done():
+        _all_news_task = asyncio.ensure_future(_fetch_all_news_once())
+    return await asyncio.shield(_all_news_task)
+
+async def _fetch_all_news_once() -> list:
+    started = time.monotonic()
+    results = await asyncio.gather(*(_fetch_source(source) for source in NEWS_SOURCES), return_exceptions=True)
+
     news = []
+    for source, result in zip(NEWS_SOURCES, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Ошибка источника {source.name}: {result}")
+            continue
+        news += result
+    total = len(news)
+    # Склейка, поиск монет и VADER — работа для CPU, не держим ею цикл событий
+    news = await asyncio.to_thread(prepare_news, news)
 
-    cryptopanic_news = fetch_cryptopanic_news()
-    news += cryptopanic_news
+    elapsed = time.monotonic() - started
+    logger.info(f"Всего получено {total} новостей ({len(news)} историй) за {elapsed:.1f} с.")
+    return news
 
-    newsapi_news = fetch_newsapi_news()
-    news += newsapi_news
+# ---------------------- Дедупликация новостей ---------------------------------
 
-    coindesk_news = fetch_coindesk_news()
-    news += coindesk_news
+def news_keys(item) -> list:
+    """Ключи новости для индекса: нормализованный URL (или GUID) и хэш заголовка."""
+    title_key = "t:" + item.title_hash
+    return [item.id] if item.id == title_key else [item.id, title_key]
 
-    cointelegraph_news = fetch_cointelegraph_news()
-    news += cointelegraph_news
+class SeenNewsStore:
+    """
+    Индекс уже отправленных новостей: ключ -> время, когда новость впервые увидели.
+    Записи старше ttl удаляются, размер ограничен max_entries (выбрасываем самые старые).
+    В хранилище уходят только добавленные и удалённые с прошлого save() ключи.
+    """
 
-    logger.info(f"Всего получено {len(news)} новостей.")
-    return news
+    def __init__(self, backend, ttl: float = NEWS_SEEN_TTL, max_entries: int = NEWS_SEEN_MAX_ENTRIES):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._seen = backend.load_seen_news()
+        self._added = {}
+        self._removed = set()
+        self._evict(time.time())
+        logger.info(f"Загружено {len(self._seen)} ключей отправленных новостей.")
+
+    def _evict(self, now: float):
+        cutoff = now - self.ttl
+        expired = [k for k, ts in self._seen.items() if ts < cutoff]
+        overflow = len(self._seen) - len(expired) - self.max_entries
+        if overflow > 0:
+            expired_set = set(expired)
+            alive = sorted((ts, k) for k, ts in self._seen.items() if k not in expired_set)
+            expired += [k for _, k in alive[:overflow]]
+        for k in expired:
+            del self._seen[k]
+            self._added.pop(k, None)
+            self._removed.add(k)
+
+    def filter_new(self, items: list) -> list:
+        """Возвращает только новости, которых нет в индексе (и не повторяются внутри items)."""
+        new_items = []
+        batch_keys = set()
+        with self._lock:
+            for item in items:
+                keys = news_keys(item)
+                if not keys:
+                    continue
+                if any(k in self._seen or k in batch_keys for k in keys):
+                    continue
+                batch_keys.update(keys)
+                new_items.append(item)
+        return new_items
+
+    def mark_seen(self, items: list):
+        now = time.time()
+        with self._lock:
+            for item in items:
+                for k in news_keys(item):
+                    if k not in self._seen:
+                        self._seen[k] = now
+                        self._added[k] = now
+                        self._removed.discard(k)
+            self._evict(now)
+
+    def save(self):
+        with self._lock:
+            added, self._added = self._added, {}
+            removed, self._removed = self._removed, set()
+        if not added and not removed:
+            return
+        try:
+            self.backend.save_seen_news(added, removed)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить индекс новостей: {e}")
+
+    def reload(self):
+        """Перечитывает индекс из хранилища (его мог пополнить другой воркер)."""
+        seen = self.backend.load_seen_news()
+        with self._lock:
+            seen.update(self._added)
+            for k in self._removed:
+                seen.pop(k, None)
+            self._seen = seen
+
+seen_news = SeenNewsStore(storage)
+
+# ---------------------- Поиск упоминаний монет --------------------------------
+
+# Тикеры короче этого не ищем: слишком много ложных совпадений
+MIN_SYMBOL_LENGTH = 3
+
+class CoinMatcher:
+    """
+    Одно скомпилированное регулярное выражение по всем отслеживаемым монетам.
+    id и названия ищутся без учёта регистра, тикеры — только заглавными (BTC, ETH),
+    чтобы не путать их с обычными словами. match() за один проход возвращает
+    все монеты, упомянутые в тексте.
+    """
+
+    def __init__(self, coins, coin_info: dict):
+        self._aliases = {}
+        names = set()
+        symbols = set()
+        for coin in coins:
+            symbol, name = coin_info.get(coin, ("", ""))
+            for alias in (coin, coin.replace("-", " "), name.lower()):
+                if alias:
+                    names.add(alias)
+                    self._aliases.setdefault(alias, set()).add(coin)
+            if len(symbol) >= MIN_SYMBOL_LENGTH:
+                symbols.add(symbol.upper())
+                self._aliases.setdefault(symbol.lower(), set()).add(coin)
+
+        def alternation(words):
+            # Длинные варианты первыми, чтобы "bitcoin cash" не превратился в "bitcoin"
+            return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+        parts = []
+        if names:
+            parts.append(f"(?i:{alternation(names)})")
+        if symbols:
+            parts.append(alternation(symbols))
+        self._pattern = re.compile(rf"(?<!\w)(?:{'|'.join(parts)})(?!\w)") if parts else None
+
+    def match(self, text: str) -> set:
+        if self._pattern is None or not text:
+            return set()
+        coins = set()
+        for m in self._pattern.finditer(text):
+            coins |= self._aliases.get(m.group(0).lower(), set())
+        return coins
+
+_coin_matcher = None
+_coin_matcher_key = None
+_coin_matcher_lock = threading.Lock()
+
+def get_coin_matcher() -> CoinMatcher:
+    """Матчер по всем подписанным монетам; перестраивается только при изменении их набора."""
+    global _coin_matcher, _coin_matcher_key
+    key = (subscription_store.coins_version, coin_index.version)
+    with _coin_matcher_lock:
+        if _coin_matcher is None or _coin_matcher_key != key:
+            _coin_matcher = CoinMatcher(subscription_store.all_coins(), coin_index.info)
+            _coin_matcher_key = key
+        return _coin_matcher
 
 # ---------------------- Анализ тональности ------------------------------------
 
-def get_sentiment_label(text: str) -> str:
-    scores = analyzer.polarity_scores(text)
-    compound = scores['compound']
+def sentiment_label_from_compound(compound: float) -> str:
     if compound >= 0.05:
         return "POSITIVE"
     elif compound <= -0.05:
@@ -231,33 +1958,535 @@ def get_sentiment_label(text: str) -> str:
     else:
         return "NEUTRAL"
 
+class SentimentService:
+    """
+    Тональность заголовков с LRU-кэшем по хэшу нормализованного текста.
+    label_many() оценивает пачку за раз; большие пачки при SENTIMENT_PROCESSES > 0
+    делятся между процессами, чтобы VADER не упирался в GIL.
+    """
+
+    def __init__(self, max_entries: int = SENTIMENT_CACHE_SIZE, processes: int = SENTIMENT_PROCESSES,
+                 min_process_batch: int = SENTIMENT_PROCESS_MIN_BATCH):
+        self.max_entries = max_entries
+        self.processes = processes
+        self.min_process_batch = min_process_batch
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # Словарь VADER загружается при первой оценке или в фоновом прогреве после старта
+        self._analyzer = None
+        self._analyzer_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def analyzer(self) -> SentimentIntensityAnalyzer:
+        with self._analyzer_lock:
+            if self._analyzer is None:
+                self._analyzer = SentimentIntensityAnalyzer()
+            return self._analyzer
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        normalized = " ".join(text.split())
+        return hashlib.sha1(normalized.encode("utf-8")).digest()
+
+    def label(self, text: str) -> str:
+        return self.label_many([text])[0]
+
+    def label_many(self, texts: list) -> list:
+        keys = [self._key(t) for t in texts]
+        labels = {}
+        missing = {}
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in labels or key in missing:
+                    continue
+                label = self._cache.get(key)
+                if label is None:
+                    missing[key] = text
+                else:
+                    self._cache.move_to_end(key)
+                    labels[key] = label
+            self._stats["hits"] += len(labels)
+            self._stats["misses"] += len(missing)
+
+        if missing:
+            scores = self._score(list(missing.values()))
+            with self._lock:
+                for key, compound in zip(missing, scores):
+                    label = sentiment_label_from_compound(compound)
+                    labels[key] = label
+                    self._cache[key] = label
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        return [labels[key] for key in keys]
+
+    def _score(self, texts: list) -> list:
+        if self.processes <= 0 or len(texts) < self.min_process_batch:
+            analyzer = self.analyzer()
+            return [analyzer.polarity_scores(t)['compound'] for t in texts]
+        with self._pool_lock:
+            if self._pool is None:
+                # fork в многопоточном процессе может унести в дочерний процесс захваченные
+                # другими потоками блокировки, поэтому процессы пула запускаются через spawn;
+                # функции пула лежат в sentiment_worker, чтобы дочерний процесс не импортировал бота
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, initializer=sentiment_worker.init_worker,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            pool = self._pool
+        size = -(-len(texts) // self.processes)
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        scores = []
+        for chunk_scores in pool.map(sentiment_worker.score_texts, chunks):
+            scores += chunk_scores
+        return scores
+
+    def shutdown(self):
+        """Останавливает процессы пула, если он создавался."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._cache)
+        return stats
+
+sentiment_service = SentimentService()
+
+def get_sentiment_label(text: str) -> str:
+    return sentiment_service.label(text)
+
 # ---------------------- Отправка сообщений -------------------------------------
 
+# Атомы HTML-текста: теги, сущности (&amp;), разделители и слова — резать можно только между ними
+_HTML_ATOM_RE = re.compile(r"<[^>]*>|&#?\w+;|\n\n|\n| |[^<&\n ]+|&")
+
+def _html_tag_name(tag: str) -> str:
+    m = re.match(r"</?\s*(\w+)", tag)
+    return m.group(1).lower() if m else ""
+
+def _is_html_tag(atom: str) -> bool:
+    return atom.startswith("<") and atom.endswith(">")
+
+def _open_html_tags(atoms: list) -> list:
+    """Стек тегов, которые остаются открытыми после atoms."""
+    stack = []
+    for atom in atoms:
+        if not _is_html_tag(atom) or atom.endswith("/>"):
+            continue
+        if atom.startswith("</"):
+            name = _html_tag_name(atom)
+            for i in range(len(stack) - 1, -1, -1):
+                if _html_tag_name(stack[i]) == name:
+                    del stack[i]
+                    break
+        else:
+            stack.append(atom)
+    return stack
+
+def _closing_html_tags(stack: list) -> str:
+    return "".join(f"</{_html_tag_name(tag)}>" for tag in reversed(stack))
+
+def _best_html_break(atoms: list, start: int) -> int:
+    """Индекс, после которого лучше резать: абзац, строка, пробел — во второй половине куска."""
+    total = sum(len(a) for a in atoms)
+    for separator in ("\n\n", "\n", " "):
+        pos = total
+        for i in range(len(atoms) - 1, start - 1, -1):
+            pos -= len(atoms[i])
+            if pos < total // 2:
+                break
+            if atoms[i] == separator:
+                return i + 1
+    return len(atoms)
+
+def _has_html_text(atoms: list) -> bool:
+    """Есть ли среди atoms видимый текст (не теги и не одни пробелы)."""
+    return any(not _is_html_tag(a) and a.strip() for a in atoms)
+
+def _drop_html_markup_over_budget(atoms: list, budget: int) -> list:
+    """
+    Убирает разметку тегов (сам тег и его закрывающий), если вместе с уже открытыми
+    тегами она заняла бы больше budget символов: такой тег нельзя было бы открыть
+    заново в каждой части рядом с текстом. Текст внутри тега остаётся.
+    """
+    result = []
+    stack = []  # (имя, разметка убрана, длина открывающего и закрывающего тега)
+    overhead = 0
+    for atom in atoms:
+        if not _is_html_tag(atom) or atom.endswith("/>"):
+            result.append(atom)
+            continue
+        name = _html_tag_name(atom)
+        if atom.startswith("</"):
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == name:
+                    _, dropped, size = stack.pop(i)
+                    if not dropped:
+                        overhead -= size
+                        result.append(atom)
+                    break
+            else:
+                result.append(atom)
+            continue
+        size = len(atom) + len(name) + 3
+        dropped = overhead + size > budget
+        stack.append((name, dropped, size))
+        if not dropped:
+            overhead += size
+            result.append(atom)
+    return result
+
+def split_html_message(text: str, limit: int = TELEGRAM_MAX_MESSAGE_LENGTH) -> list:
+    """
+    Делит HTML-сообщение на части не длиннее limit. Режет по абзацам, строкам или пробелам,
+    никогда внутри тега или сущности; незакрытые теги закрываются в конце части
+    и открываются заново в начале следующей. Открытые теги занимают не больше половины
+    части, слова длиннее четверти режутся: так в каждую часть помещаются теги и текст.
+    Теги сверх этого бюджета (например, ссылка с огромным URL) теряют разметку, текст
+    остаётся. Частей без видимого текста не бывает.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    piece = max(1, limit // 4)
+    atoms = []
+    for atom in _HTML_ATOM_RE.findall(text):
+        if len(atom) > piece and not _is_html_tag(atom):
+            atoms += [atom[i:i + piece] for i in range(0, len(atom), piece)]
+        else:
+            atoms.append(atom)
+    atoms = _drop_html_markup_over_budget(atoms, limit // 2)
+
+    chunks = []
+    cur = []       # атомы текущей части, начиная с заново открытых тегов
+    reopened = 0   # сколько атомов в начале cur — заново открытые теги
+    cur_len = 0
+    stack = []     # теги, открытые в cur; cur_len + закрывающие теги stack <= limit
+    for atom in atoms:
+        next_stack = _open_html_tags(stack + [atom]) if _is_html_tag(atom) else stack
+        while cur_len + len(atom) + len(_closing_html_tags(next_stack)) > limit:
+            if not _has_html_text(cur):
+                # Одни теги без текста (пустые элементы) — оставляем только открытые
+                cur, reopened = list(stack), len(stack)
+                cur_len = sum(len(a) for a in cur)
+                break
+            cut = _best_html_break(cur, reopened)
+            head_stack = _open_html_tags(cur[:cut])
+            if (not _has_html_text(cur[:cut])
+                    or sum(len(a) for a in cur[:cut]) + len(_closing_html_tags(head_stack)) > limit):
+                cut, head_stack = len(cur), stack
+            head, tail = cur[:cut], cur[cut:]
+            chunks.append(("".join(head) + _closing_html_tags(head_stack)).strip())
+            cur = head_stack + tail
+            reopened = len(head_stack)
+            cur_len = sum(len(a) for a in cur)
+            stack = _open_html_tags(cur)
+            next_stack = _open_html_tags(stack + [atom]) if _is_html_tag(atom) else stack
+        cur.append(atom)
+        cur_len += len(atom)
+        stack = next_stack
+
+    if _has_html_text(cur):
+        chunks.append(("".join(cur) + _closing_html_tags(stack)).strip())
+    return chunks
+
+class TokenBucket:
+    """Классическое ведро токенов: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 — можно сейчас)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+def worker_for_chat(chat_id, worker_count: int = WORKER_COUNT) -> int:
+    """Номер воркера, который отправляет сообщения в чат (стабильно между процессами)."""
+    if worker_count <= 1:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % worker_count
+
+class OutgoingMessage:
+    __slots__ = ("id", "chat_id", "text", "parse_mode", "created_at", "attempts")
+
+    def __init__(self, msg_id, chat_id, text, parse_mode, created_at):
+        self.id = msg_id
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.created_at = created_at
+        self.attempts = 0
+
+class MessageSender:
+    """
+    Очередь исходящих сообщений с учётом лимитов Telegram.
+
+    Общее ведро токенов ограничивает весь бот, отдельные вёдра — каждый чат
+    (личные чаты и группы/каналы с разными лимитами). Внутри чата порядок
+    сообщений сохраняется, чаты между собой друг друга не ждут. На RetryAfter
+    вся отправка ставится на паузу, сетевые ошибки повторяются с экспоненциальной
+    задержкой. Очередь хранится в storage, поэтому переживает перезапуск. После
+    start() запись в storage идёт в отдельном потоке: enqueue() только откладывает
+    сообщения, а одна задача пишет их пачками по порядку и ставит в очередь отправки.
+
+    При нескольких воркерах каждый чат принадлежит одному из них (worker_for_chat):
+    сообщение может поставить в очередь любой воркер, а отправляет владелец чата,
+    подхватывая чужие записи из storage в sync_outbox(). Общий лимит бота делится
+    между воркерами поровну.
+    """
+
+    def __init__(self, backend, workers: int = SEND_WORKERS,
+                 worker_index: int = WORKER_INDEX, worker_count: int = WORKER_COUNT):
+        self.backend = backend
+        self.bot = None
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        self._wakeup = asyncio.Event()
+        global_rate = TELEGRAM_GLOBAL_RATE / worker_count
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._chats = {}         # chat_id -> deque сообщений по порядку
+        self._ready = []         # heap (ready_at, seq, chat_id) для чатов с сообщениями
+        self._scheduled = set()  # чаты, которые уже лежат в _ready
+        self._in_flight = set()  # чаты, сообщение которых отправляется прямо сейчас
+        self._seq = 0
+        self._paused_until = 0.0
+        self._tasks = set()      # выполняющиеся отправки
+        self._runner = None
+        self._workers = workers
+        self._latencies = deque(maxlen=1000)
+        self._stats = {"sent": 0, "retried": 0, "dropped": 0}
+        self._queued_ids = set()
+        self._unsaved = []       # (chat_id, текст, parse_mode, created_at), ещё не записанные в storage
+        self._saving = 0         # сколько сообщений пишется в storage прямо сейчас
+        self._saver = None
+        self._outbox_cursor = 0  # id последней просмотренной записи очереди в storage
+        self.sync_outbox()
+
+    def owns(self, chat_id: str) -> bool:
+        return worker_for_chat(chat_id, self.worker_count) == self.worker_index
+
+    def sync_outbox(self):
+        """Подхватывает из storage сообщения для своих чатов, поставленные другими воркерами."""
+        for record in self.backend.load_outbox(after_id=self._outbox_cursor):
+            self._outbox_cursor = max(self._outbox_cursor, record["id"])
+            if record["id"] in self._queued_ids or not self.owns(record["chat_id"]):
+                continue
+            self._append(OutgoingMessage(
+                record["id"], record["chat_id"], record["text"],
+                record["parse_mode"], record["created_at"],
+            ))
+
+    def start(self, bot):
+        """Запускает цикл отправки; вызывать из работающего цикла событий."""
+        self.bot = bot
+        self._runner = asyncio.create_task(self._run())
+        pending = self.queue_depth()
+        if pending:
+            logger.info(f"В очереди отправки с прошлого запуска: {pending} сообщений.")
+
+    def enqueue(self, chat_id, text: str, parse_mode: str = ParseMode.HTML):
+        parts = split_html_message(text) if parse_mode == ParseMode.HTML else [
+            text[i:i + TELEGRAM_MAX_MESSAGE_LENGTH]
+            for i in range(0, len(text), TELEGRAM_MAX_MESSAGE_LENGTH)
+        ]
+        created_at = time.time()
+        records = [(str(chat_id), part, parse_mode, created_at) for part in parts]
+        if self._runner is None:
+            # Цикл отправки ещё не запущен: писать в storage некому, кроме вызывающего
+            self._queue_saved(records, self._save(records))
+            return
+        self._unsaved += records
+        if self._saver is None:
+            self._saver = asyncio.create_task(self._save_unsaved())
+
+    def _save(self, records: list) -> list:
+        """Пишет сообщения в storage; id записанных, None — для не записанных."""
+        ids = []
+        for record in records:
+            try:
+                ids.append(self.backend.add_outbox(*record))
+            except Exception as e:
+                logger.warning(f"Не удалось поставить сообщение в чат {record[0]} в очередь: {e}")
+                ids.append(None)
+        return ids
+
+    def _queue_saved(self, records: list, ids: list):
+        for (chat_id, text, parse_mode, created_at), msg_id in zip(records, ids):
+            # sync_outbox() мог подхватить запись раньше нас
+            if msg_id is not None and msg_id not in self._queued_ids and self.owns(chat_id):
+                self._append(OutgoingMessage(msg_id, chat_id, text, parse_mode, created_at))
+
+    async def _save_unsaved(self):
+        try:
+            while self._unsaved:
+                records, self._unsaved = self._unsaved, []
+                self._saving = len(records)
+                try:
+                    ids = await asyncio.to_thread(self._save, records)
+                finally:
+                    self._saving = 0
+                self._queue_saved(records, ids)
+        finally:
+            self._saver = None
+
+    async def flush(self):
+        """Дожидается записи отложенных сообщений в storage."""
+        while self._saver is not None:
+            await asyncio.shield(self._saver)
+
+    def _append(self, msg: OutgoingMessage):
+        self._queued_ids.add(msg.id)
+        self._chats.setdefault(msg.chat_id, deque()).append(msg)
+        self._schedule(msg.chat_id, time.monotonic())
+        self._wakeup.set()
+
+    def _schedule(self, chat_id: str, ready_at: float):
+        if chat_id in self._scheduled or chat_id in self._in_flight or not self._chats.get(chat_id):
+            return
+        self._seq += 1
+        heapq.heappush(self._ready, (ready_at, self._seq, chat_id))
+        self._scheduled.add(chat_id)
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id.startswith("-"):
+                bucket = TokenBucket(TELEGRAM_GROUP_CHAT_RATE, TELEGRAM_GROUP_CHAT_BURST)
+            else:
+                bucket = TokenBucket(TELEGRAM_PRIVATE_CHAT_RATE)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait(self, timeout: float = None):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if not self._ready or len(self._in_flight) >= self._workers:
+                await self._wait()
+                continue
+            ready_at, _, chat_id = self._ready[0]
+            if ready_at > now:
+                await self._wait(ready_at - now)
+                continue
+            heapq.heappop(self._ready)
+            self._scheduled.discard(chat_id)
+
+            chat_bucket = self._chat_bucket(chat_id)
+            wait_for = max(
+                self._paused_until - now,
+                self._global_bucket.delay(now),
+                chat_bucket.delay(now),
+            )
+            if wait_for > 0:
+                self._schedule(chat_id, now + wait_for)
+                continue
+            self._global_bucket.consume(now)
+            chat_bucket.consume(now)
+            self._in_flight.add(chat_id)
+            task = asyncio.create_task(self._send(self._chats[chat_id][0]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, msg: OutgoingMessage):
+        retry_in = None
+        try:
+            await self.bot.send_message(
+                chat_id=msg.chat_id,
+                text=msg.text,
+                parse_mode=msg.parse_mode,
+                disable_web_page_preview=True,
+            )
+            outcome = "sent"
+        except RetryAfter as e:
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logger.warning(f"Telegram просит подождать {e.retry_after} с, отправка на паузе.")
+            outcome, retry_in = "retried", 0.0
+        except (BadRequest, Forbidden, ChatMigrated) as e:
+            logger.warning(f"Сообщение в чат {msg.chat_id} отброшено: {e}")
+            outcome = "dropped"
+        except Exception as e:
+            msg.attempts += 1
+            if msg.attempts >= SEND_MAX_ATTEMPTS:
+                logger.warning(f"Не удалось отправить сообщение в чат {msg.chat_id} за {msg.attempts} попыток: {e}")
+                outcome = "dropped"
+            else:
+                retry_in = min(2 ** msg.attempts, 60)
+                logger.warning(f"Ошибка отправки в чат {msg.chat_id}, повтор через {retry_in} с: {e}")
+                outcome = "retried"
+
+        if outcome != "retried":
+            try:
+                await asyncio.to_thread(self.backend.remove_outbox, msg.id)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить сообщение {msg.id} из очереди: {e}")
+
+        self._stats[outcome] += 1
+        self._in_flight.discard(msg.chat_id)
+        if outcome == "sent":
+            self._latencies.append(time.time() - msg.created_at)
+        if outcome != "retried":
+            queue = self._chats[msg.chat_id]
+            queue.popleft()
+            self._queued_ids.discard(msg.id)
+            if not queue:
+                del self._chats[msg.chat_id]
+        self._schedule(msg.chat_id, time.monotonic() + (retry_in or 0.0))
+        self._wakeup.set()
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._chats.values()) + len(self._unsaved) + self._saving
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        stats = dict(self._stats)
+        stats["queue_depth"] = self.queue_depth()
+        stats["in_flight"] = len(self._in_flight)
+        if latencies:
+            stats["latency_p50"] = round(latencies[len(latencies) // 2], 3)
+            stats["latency_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+            stats["latency_p99"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3)
+            stats["latency_max"] = round(latencies[-1], 3)
+        return stats
+
+message_sender = MessageSender(storage)
+
 def send_telegram_message(chat_id: str, text: str, parse_mode: str = ParseMode.HTML):
-    max_length = 4096
+    """Ставит сообщение в очередь отправки; длинные сообщения делятся по границам HTML."""
     try:
-        if len(text) <= max_length:
-            bot_context.bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                parse_mode=parse_mode,
-                disable_web_page_preview=True
-            )
-        else:
-            # Разбиваем на части, если сообщение слишком длинное
-            for i in range(0, len(text), max_length):
-                chunk = text[i:i + max_length]
-                bot_context.bot.send_message(
-                    chat_id=chat_id,
-                    text=chunk,
-                    parse_mode=parse_mode,
-                    disable_web_page_preview=True
-                )
+        message_sender.enqueue(chat_id, text, parse_mode)
     except Exception as e:
         logger.warning(f"Ошибка при отправке сообщения пользователю {chat_id}: {e}")
 
 # ---------------------- Клавиатура (ReplyKeyboard) -----------------------------
-def show_main_keyboard(update_or_context):
+async def show_main_keyboard(update_or_context):
     """
     ВАЖНО: убираем кнопку Start, а также меняем эмодзи кнопок
     Так что в первой строке: News, Price, Volatility, Telegram
@@ -274,12 +2503,12 @@ def show_main_keyboard(update_or_context):
     )
 
     if isinstance(update_or_context, Update):
-        update_or_context.message.reply_text(
+        await update_or_context.message.reply_text(
             "Выберите действие:",
             reply_markup=reply_markup
         )
     else:
-        update_or_context.bot.send_message(
+        await update_or_context.bot.send_message(
             chat_id=update_or_context.effective_chat.id,
             text="Выберите действие:",
             reply_markup=reply_markup
@@ -287,7 +2516,7 @@ def show_main_keyboard(update_or_context):
 
 # ---------------------- Обработчики команд -------------------------------------
 
-def start_command(update: Update, context: CallbackContext):
+async def start_command(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
     logger.info(f"Получена команда /start от пользователя {user_id}")
     welcome_text = (
@@ -295,79 +2524,158 @@ def start_command(update: Update, context: CallbackContext):
         "Я помогу вам получать новости и отслеживать курсы криптовалют.\n"
         "Ниже — меню для управления (кнопки)."
     )
-    update.message.reply_text(welcome_text, parse_mode=ParseMode.MARKDOWN)
-    show_main_keyboard(update)
+    await update.message.reply_text(welcome_text, parse_mode=ParseMode.MARKDOWN)
+    await show_main_keyboard(update)
 
-def help_command(update: Update, context: CallbackContext):
+async def help_command(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
     logger.info(f"Получена команда /help от пользователя {user_id}")
     help_text = (
         "Доступные команды:\n\n"
         "• /start — запустить или перезапустить бота (без кнопки)\n"
         "• /help — список команд\n"
-        "• /unsubscribe <coin> — отписка от конкретной криптовалюты\n\n"
-        "Все названия криптовалют указывайте **латиницей**, "
-        "в соответствии с CoinGecko ID (bitcoin, ethereum, solana и т.д.).\n"
-        "Чтобы найти точное имя, смотрите в URL на CoinGecko или обращайтесь к списку монет."
+        "• /unsubscribe <coin> — отписка от конкретной криптовалюты\n"
+        "• /alert <coin> <процент> [окно] — оповещение об изменении цены; "
+        "окно: ref (от текущей цены, по умолчанию), 1h, 24h, 7d, 14d, 30d. "
+        "Без аргументов — список ваших оповещений\n"
+        "• /unalert <coin> [окно] — удалить оповещение\n\n"
+        "Все названия криптовалют указывайте **латиницей**: CoinGecko ID, "
+        "тикер или название (bitcoin, btc, Bitcoin и т.д.).\n"
+        "Если монета не найдена, бот подскажет похожие названия."
     )
-    update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
-    show_main_keyboard(update)
+    await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
+    await show_main_keyboard(update)
+
+async def unsubscribe_command(update: Update, context: CallbackContext):
+    user_id = str(update.message.from_user.id)
+    logger.info(f"Получена команда /unsubscribe от пользователя {user_id}")
+
+    if len(context.args) == 0:
+        subs = get_user_subscriptions(user_id)
+        if subs:
+            lines = [f"- {s}" for s in subs]
+            text_subs = "Ваши активные подписки:\n" + "\n".join(lines)
+            await update.message.reply_text(
+                f"{text_subs}\n\nВведите криптовалюту, от которой хотите отписаться (латиницей)."
+            )
+            await set_awaiting_reply(user_id, "unsubscribe")
+        else:
+            await update.message.reply_text("У вас нет активных подписок.")
+            await show_main_keyboard(update)
+        return
+
+    subscription = resolve_user_subscription(user_id, context.args[0])
+    success = await asyncio.to_thread(remove_subscription, user_id, subscription)
+    if success:
+        await update.message.reply_text(f"Вы успешно отписались от {subscription}.")
+    else:
+        await update.message.reply_text(f"Вы не были подписаны на {subscription}.")
+    await show_main_keyboard(update)
+
+async def alert_command(update: Update, context: CallbackContext):
+    user_id = str(update.message.from_user.id)
+    logger.info(f"Получена команда /alert от пользователя {user_id}")
+
+    if len(context.args) == 0:
+        rules = alert_engine.rules_for(user_id)
+        if rules:
+            lines = [f"- {coin}: {threshold:g}% ({window})" for coin, window, threshold in rules]
+            await update.message.reply_text("Ваши оповещения о ценах:\n" + "\n".join(lines))
+        else:
+            await update.message.reply_text(
+                "У вас нет оповещений о ценах.\nПример: /alert bitcoin 5 24h"
+            )
+        return
+
+    if not await coin_index_ready():
+        await update.message.reply_text(COIN_INDEX_LOADING_TEXT)
+        return
+    coin = resolve_coin(context.args[0])
+    window = context.args[2].lower() if len(context.args) > 2 else "ref"
+    try:
+        threshold = float(context.args[1].replace(",", ".")) if len(context.args) > 1 else None
+    except ValueError:
+        threshold = None
+    if threshold is None or not math.isfinite(threshold) or threshold <= 0 or window not in ALERT_WINDOWS:
+        await update.message.reply_text(
+            "Формат: /alert <coin> <процент> [окно]\n"
+            f"Окна: {', '.join(ALERT_WINDOWS)}. Пример: /alert bitcoin 5 24h"
+        )
+        return
+    if coin is None:
+        await update.message.reply_text(
+            f"Криптовалюта '{context.args[0]}' не найдена на CoinGecko. "
+            f"{format_coin_suggestions(context.args[0]) or 'Проверьте написание (латиницей).'}"
+        )
+        return
+
+    ref_price = None
+    if window == "ref":
+        ref_price = (await get_market_data([coin])).get(coin, {}).get("current_price")
+    if await asyncio.to_thread(alert_engine.add_rule, user_id, coin, threshold, window, ref_price):
+        period = "от текущей цены" if window == "ref" else f"за {window}"
+        await update.message.reply_text(f"Оповещение установлено: {coin} на {threshold:g}% {period}.")
+    else:
+        await update.message.reply_text(
+            f"Можно установить не больше {ALERT_MAX_RULES_PER_USER} оповещений. Удалите лишние через /unalert."
+        )
 
-def unsubscribe_command(update: Update, context: CallbackContext):
+async def unalert_command(update: Update, context: CallbackContext):
     user_id = str(update.message.from_user.id)
-    logger.info(f"Получена команда /unsubscribe от пользователя {user_id}")
+    logger.info(f"Получена команда /unalert от пользователя {user_id}")
 
     if len(context.args) == 0:
-        subs = get_user_subscriptions(user_id)
-        if subs:
-            lines = [f"- {s}" for s in subs]
-            text_subs = "Ваши активные подписки:\n" + "\n".join(lines)
-            update.message.reply_text(
-                f"{text_subs}\n\nВведите криптовалюту, от которой хотите отписаться (латиницей)."
-            )
-            context.user_data["awaiting_unsubscribe"] = True
-        else:
-            update.message.reply_text("У вас нет активных подписок.")
-            show_main_keyboard(update)
+        await update.message.reply_text("Формат: /unalert <coin> [окно]")
         return
-
-    subscription = context.args[0].lower()
-    success = remove_subscription(user_id, subscription)
-    if success:
-        update.message.reply_text(f"Вы успешно отписались от {subscription}.")
+    coin = context.args[0].lower()
+    if not any(rule_coin == coin for rule_coin, _, _ in alert_engine.rules_for(user_id)):
+        coin = resolve_coin(coin) or coin
+    window = context.args[1].lower() if len(context.args) > 1 else None
+    if await asyncio.to_thread(alert_engine.remove_rule, user_id, coin, window):
+        await update.message.reply_text(f"Оповещение по {coin} удалено.")
     else:
-        update.message.reply_text(f"Вы не были подписаны на {subscription}.")
-    show_main_keyboard(update)
+        await update.message.reply_text(f"У вас нет оповещения по {coin}.")
+
+def format_coin_suggestions(text: str) -> str:
+    suggestions = coin_index.suggest(text)
+    return f"Возможно, вы имели в виду: {', '.join(suggestions)}." if suggestions else ""
+
+def resolve_user_subscription(user_id: str, text: str) -> str:
+    """Монета из подписок пользователя по id, тикеру или названию ("btc" -> bitcoin)."""
+    text = text.strip().lower()
+    if text in get_user_subscriptions(user_id):
+        return text
+    return coin_index.resolve(text) or text
 
 # ---------------------- Обработчик обычных сообщений (ReplyKeyboard) ----------
 
-def handle_message(update: Update, context: CallbackContext):
+async def handle_message(update: Update, context: CallbackContext):
     user_id_str = str(update.message.from_user.id)
     user_id_int = update.message.from_user.id
     text = update.message.text.strip().lower()
 
     if text == "📰 news":
-        handle_news(update, context)
+        await handle_news(update, context)
     elif text == "💰 price":
-        handle_price(update, context)
+        await handle_price(update, context)
     elif text == "📈 volatility":
-        handle_volatility(update, context)
+        await handle_volatility(update, context)
     elif text == "📨 telegram":
-        if is_user_in_channel(context.bot, user_id_int, CHANNEL_ID):
-            update.message.reply_text(
+        if await is_user_in_channel(context.bot, user_id_int, CHANNEL_ID):
+            await update.message.reply_text(
                 f"Вы уже подписаны на канал!\nСсылка: {CHANNEL_INVITE_LINK}"
             )
-            show_main_keyboard(update)
+            await show_main_keyboard(update)
         else:
             prompt = (
                 "Похоже, вы ещё не подписаны на наш канал.\n"
                 "Хотите подписаться? Напишите 'Да' или 'Нет'."
             )
-            update.message.reply_text(prompt)
-            context.user_data["awaiting_channel_subscribe"] = True
+            await update.message.reply_text(prompt)
+            await set_awaiting_reply(user_id_str, "channel_subscribe")
 
     elif text == "🆘 help":
-        help_command(update, context)
+        await help_command(update, context)
 
     elif text == "🔔 subscribe":
         subs = get_user_subscriptions(user_id_str)
@@ -380,29 +2688,29 @@ def handle_message(update: Update, context: CallbackContext):
             msg = ("У вас пока нет подписок.\n"
                    "Введите криптовалюты (через запятую), латиницей.\n"
                    "Например: `bitcoin, ethereum, solana`")
-        update.message.reply_text(msg)
-        context.user_data["awaiting_subscribe"] = True
+        await update.message.reply_text(msg)
+        await set_awaiting_reply(user_id_str, "subscribe")
 
     elif text == "🔕 unsubscribe":
         subs = get_user_subscriptions(user_id_str)
         if subs:
             lines = [f"- {s}" for s in subs]
             text_subs = "Ваши активные подписки:\n" + "\n".join(lines)
-            update.message.reply_text(
+            await update.message.reply_text(
                 f"{text_subs}\n\nВведите криптовалюту, от которой хотите отписаться (латиницей)."
             )
-            context.user_data["awaiting_unsubscribe"] = True
+            await set_awaiting_reply(user_id_str, "unsubscribe")
         else:
-            update.message.reply_text("У вас нет активных подписок.")
-            show_main_keyboard(update)
+            await update.message.reply_text("У вас нет активных подписок.")
+            await show_main_keyboard(update)
 
     elif text == "start":
         # Команда /start без кнопки
-        start_command(update, context)
+        await start_command(update, context)
 
     elif text == "help":
         # Команда /help без кнопки
-        help_command(update, context)
+        await help_command(update, context)
 
     elif text == "unsubscribe":
         # Команда /unsubscribe без кнопки
@@ -410,17 +2718,22 @@ def handle_message(update: Update, context: CallbackContext):
         if subs:
             lines = [f"- {s}" for s in subs]
             text_subs = "Ваши активные подписки:\n" + "\n".join(lines)
-            update.message.reply_text(
+            await update.message.reply_text(
                 f"{text_subs}\n\nВведите криптовалюту, от которой хотите отписаться (латиницей)."
             )
-            context.user_data["awaiting_unsubscribe"] = True
+            await set_awaiting_reply(user_id_str, "unsubscribe")
         else:
-            update.message.reply_text("У вас нет активных подписок.")
-            show_main_keyboard(update)
+            await update.message.reply_text("У вас нет активных подписок.")
+            await show_main_keyboard(update)
 
     else:
         # Состояния
-        if context.user_data.get("awaiting_subscribe"):
+        awaiting = await get_awaiting_reply(user_id_str)
+        if awaiting == "subscribe":
+            if not await coin_index_ready():
+                # Вопрос остаётся открытым: список можно прислать ещё раз
+                await update.message.reply_text(COIN_INDEX_LOADING_TEXT)
+                return
             cryptos = [c.strip().lower() for c in update.message.text.split(",")]
             subscribed = []
             already = []
@@ -429,14 +2742,15 @@ def handle_message(update: Update, context: CallbackContext):
             for crypto in cryptos:
                 if not crypto:
                     continue
-                if crypto not in SUPPORTED_COINS:
-                    invalid.append(crypto)
+                coin = resolve_coin(crypto)
+                if coin is None:
+                    suggestions = coin_index.suggest(crypto)
+                    invalid.append(f"{crypto} (возможно, {', '.join(suggestions)}?)" if suggestions else crypto)
                     continue
-                if crypto in get_user_subscriptions(user_id_str):
-                    already.append(crypto)
-                    continue
-                add_subscription(user_id_str, crypto)
-                subscribed.append(crypto)
+                if await asyncio.to_thread(add_subscription, user_id_str, coin):
+                    subscribed.append(coin)
+                else:
+                    already.append(coin)
 
             msg_list = []
             if subscribed:
@@ -450,183 +2764,513 @@ def handle_message(update: Update, context: CallbackContext):
                 )
 
             if not msg_list:
-                update.message.reply_text("Не распознаны корректные криптовалюты, попробуйте ещё раз.")
+                await update.message.reply_text("Не распознаны корректные криптовалюты, попробуйте ещё раз.")
             else:
-                update.message.reply_text("\n".join(msg_list))
+                await update.message.reply_text("\n".join(msg_list))
 
-            context.user_data["awaiting_subscribe"] = False
-            show_main_keyboard(update)
+            await set_awaiting_reply(user_id_str, None)
+            await show_main_keyboard(update)
 
-        elif context.user_data.get("awaiting_unsubscribe"):
-            subscription = update.message.text.strip().lower()
-            success = remove_subscription(user_id_str, subscription)
+        elif awaiting == "unsubscribe":
+            subscription = resolve_user_subscription(user_id_str, update.message.text)
+            success = await asyncio.to_thread(remove_subscription, user_id_str, subscription)
             if success:
-                update.message.reply_text(f"Вы успешно отписались от {subscription}.")
+                await update.message.reply_text(f"Вы успешно отписались от {subscription}.")
             else:
-                update.message.reply_text(
+                await update.message.reply_text(
                     f"Либо вы не были подписаны на '{subscription}',\n"
                     "либо название криптовалюты некорректно. "
                     "Проверьте написание и попробуйте ещё раз."
                 )
-            context.user_data["awaiting_unsubscribe"] = False
-            show_main_keyboard(update)
+            await set_awaiting_reply(user_id_str, None)
+            await show_main_keyboard(update)
 
-        elif context.user_data.get("awaiting_channel_subscribe"):
+        elif awaiting == "channel_subscribe":
             if text in ["да", "yes", "lf", "д"]:
-                update.message.reply_text(
+                await update.message.reply_text(
                     f"Отлично! Вот ссылка на канал:\n{CHANNEL_INVITE_LINK}\n\n"
                     "После вступления повторно нажмите кнопку Telegram,\n"
                     "чтобы бот увидел, что вы подписались."
                 )
             else:
-                update.message.reply_text("Хорошо, будем ждать вашего решения позже.")
-            context.user_data["awaiting_channel_subscribe"] = False
-            show_main_keyboard(update)
+                await update.message.reply_text("Хорошо, будем ждать вашего решения позже.")
+            await set_awaiting_reply(user_id_str, None)
+            await show_main_keyboard(update)
 
         else:
-            update.message.reply_text("Не понял команду. Попробуйте воспользоваться кнопками ниже.")
-            show_main_keyboard(update)
+            await update.message.reply_text("Не понял команду. Попробуйте воспользоваться кнопками ниже.")
+            await show_main_keyboard(update)
+
+# ---------------------- Рыночные данные (фоновый опрос) -----------------------
+
+class MarketSnapshot:
+    """Последние данные /coins/markets по монете: id -> ответ CoinGecko."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self.updated_at = 0.0
+
+    def get_many(self, coins) -> dict:
+        with self._lock:
+            return {c: self._data[c] for c in coins if c in self._data}
+
+    def update(self, items: list, keep: set = None):
+        """Добавляет свежие данные; если передан keep, монеты вне него выбрасываются."""
+        with self._lock:
+            for item in items:
+                coin_id = item.get("id", "").lower()
+                if coin_id:
+                    self._data[coin_id] = item
+            if keep is not None:
+                self._data = {c: v for c, v in self._data.items() if c in keep}
+            self.updated_at = time.time()
+
+    def prices(self) -> dict:
+        """id монеты -> текущая цена в USD."""
+        with self._lock:
+            return {
+                c: item["current_price"] for c, item in self._data.items()
+                if item.get("current_price") is not None
+            }
+
+market_snapshot = MarketSnapshot()
+
+async def fetch_markets(coins: list) -> list:
+    """Один батч /coins/markets на каждые MARKET_IDS_PER_REQUEST монет."""
+    coins = sorted(set(coins))
+    items = []
+    for i in range(0, len(coins), MARKET_IDS_PER_REQUEST):
+        chunk = coins[i:i + MARKET_IDS_PER_REQUEST]
+        items += await cg.get_coins_markets(
+            vs_currency="usd",
+            ids=",".join(chunk),
+            per_page=MARKET_IDS_PER_REQUEST,
+            price_change_percentage=MARKET_PRICE_CHANGE_PERIODS,
+        )
+    return items
+
+def tracked_coins() -> set:
+    """Все монеты, по которым нужны данные: подписки пользователей и монеты для оповещений."""
+    return subscription_store.all_coins() | alert_engine.coins()
+
+async def poll_market_data():
+    coins = tracked_coins()
+    if not coins:
+        return
+    try:
+        items = await fetch_markets(list(coins))
+    except Exception as e:
+        logger.warning(f"Не удалось обновить снимок рынка: {e}")
+        return
+    market_snapshot.update(items, keep=coins)
+    rolling_stats.retain(coins)
+    rolling_stats.update(market_snapshot.prices(), market_snapshot.updated_at)
+    logger.info(f"Снимок рынка обновлён: {len(items)} монет из {len(coins)}.")
+
+async def get_market_data(coins: list) -> dict:
+    """
+    Данные по монетам из снимка. Монеты, которых в снимке ещё нет (например, только что
+    подписались), запрашиваем один раз напрямую и добавляем в снимок.
+    """
+    found = market_snapshot.get_many(coins)
+    missing = [c for c in coins if c not in found]
+    if missing:
+        try:
+            items = await fetch_markets(missing)
+            market_snapshot.update(items)
+            found.update(market_snapshot.get_many(missing))
+        except Exception as e:
+            logger.warning(f"Ошибка при запросе /coins/markets: {e}")
+    return found
+
+# ---------------------- История цен ---------------------------------------------
+
+_PRICE_BAR = np.dtype([("t", "f8"), ("open", "f8"), ("high", "f8"), ("low", "f8"), ("close", "f8")])
+
+class PriceHistory:
+    """
+    Локальная история цен: по файлу на монету и уровень детализации.
+
+    Файл — кольцо баров OHLC фиксированного размера (срок хранения / шаг), открытое через
+    np.memmap. Бар, начинающийся в t, лежит в ячейке (t // шаг) % размер, поэтому запись
+    не требует ни заголовка, ни индекса: выборка дополняет текущий бар или затирает бар,
+    вышедший за срок хранения. Чтение окна — одна векторная выборка ячеек с проверкой
+    их времени. Открытыми остаются max_open последних использованных файлов, но не меньше,
+    чем затрагивает одна выборка (уровни × монеты): иначе каждая выборка вытесняла бы
+    файлы, которые понадобятся ей же на следующем опросе.
+    """
+
+    def __init__(self, directory: str = PRICE_HISTORY_DIR, tiers: tuple = PRICE_HISTORY_TIERS,
+                 max_open: int = PRICE_HISTORY_OPEN_FILES):
+        self.directory = directory
+        self.tiers = {name: (step, retention // step) for name, step, retention in tiers}
+        self.max_open = max(1, max_open)
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()  # (монета, уровень) -> memmap, в порядке использования
+        self._working_set = 0  # сколько файлов затронула последняя выборка
+        self._samples = 0
+        self.last_sample_at = 0.0
+
+    def _ring(self, coin: str, tier: str, create: bool):
+        key = (coin, tier)
+        ring = self._rings.get(key)
+        if ring is not None:
+            self._rings.move_to_end(key)
+            return ring
+        step, size = self.tiers[tier]
+        path = os.path.join(self.directory, f"{re.sub(r'[^a-z0-9._-]', '_', coin)}.{tier}.bin")
+        exists = os.path.exists(path)
+        if exists and os.path.getsize(path) != size * _PRICE_BAR.itemsize:
+            # Поменялся срок хранения уровня — старый файл уже не ляжет в кольцо
+            logger.warning(f"История {path} другого размера, начинаем заново.")
+            exists = False
+        if not exists:
+            if not create:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+        ring = np.memmap(path, dtype=_PRICE_BAR, mode="r+" if exists else "w+", shape=(size,))
+        self._rings[key] = ring
+        while len(self._rings) > max(self.max_open, self._working_set):
+            # Выборки из кольца — копии (индексация массивом), так что после flush()
+            # словарь держит последнюю ссылку и отображение закрывается вместе с ней
+            self._rings.popitem(last=False)[1].flush()
+        return ring
+
+    def append(self, coin: str, t: float, price: float):
+        with self._lock:
+            for tier, (step, size) in self.tiers.items():
+                ring = self._ring(coin, tier, create=True)
+                bucket = int(t // step)
+                slot = bucket % size
+                if ring["t"][slot] != bucket * step:
+                    ring[slot] = (bucket * step, price, price, price, price)
+                else:
+                    ring["high"][slot] = max(ring["high"][slot], price)
+                    ring["low"][slot] = min(ring["low"][slot], price)
+                    ring["close"][slot] = price
+            self._samples += 1
+
+    def record(self, prices: dict, t: float):
+        """Добавляет выборку цен (id монеты -> цена) в момент t."""
+        self._working_set = len(self.tiers) * len(prices)
+        for coin, price in prices.items():
+            if price and price > 0:
+                self.append(coin, t, float(price))
+        self.last_sample_at = t
+
+    def bars(self, coin: str, tier: str, since: float, until: float):
+        """Бары уровня tier c началом в [since, until], по времени."""
+        step, size = self.tiers[tier]
+        with self._lock:
+            ring = self._ring(coin, tier, create=False)
+            if ring is None:
+                return np.empty(0, dtype=_PRICE_BAR)
+            last = int(until // step)
+            first = max(int(since // step), last - size + 1)
+            buckets = np.arange(first, last + 1)
+            bars = ring[buckets % size]
+        return bars[bars["t"] == buckets * step]
+
+    def volatility(self, coin: str, now: float = None, windows: dict = VOLATILITY_WINDOWS) -> dict:
+        """Метрики по окнам windows: окно -> volatility_metrics() или None."""
+        now = time.time() if now is None else now
+        result = {}
+        for window, (tier, length) in windows.items():
+            step = self.tiers[tier][0]
+            result[window] = volatility_metrics(self.bars(coin, tier, now - length, now), step, length)
+        return result
+
+    def close(self):
+        with self._lock:
+            for ring in self._rings.values():
+                ring.flush()
+            self._rings.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"open_files": len(self._rings), "samples": self._samples}
+
+def volatility_metrics(bars, step: float, length: float):
+    """
+    Метрики окна по барам OHLC, в процентах:
+    change — изменение цены, stddev — стандартное отклонение лог-доходностей баров,
+    приведённое к длине окна, atr — средний истинный диапазон бара относительно цены,
+    drawdown — наибольшая просадка от максимума, coverage — доля окна, покрытая историей.
+    """
+    bars = bars[bars["close"] > 0]
+    if len(bars) < 2:
+        return None
+    closes = bars["close"]
+    prev_close = closes[:-1]
+    returns = np.diff(np.log(closes))
+    true_range = np.maximum(bars["high"][1:], prev_close) - np.minimum(bars["low"][1:], prev_close)
+    peaks = np.maximum.accumulate(bars["high"])
+    return {
+        "change": float((closes[-1] / bars["open"][0] - 1) * 100),
+        "stddev": float(returns.std() * np.sqrt(len(returns)) * 100),
+        "atr": float((true_range / prev_close).mean() * 100),
+        "drawdown": float((bars["low"] / peaks - 1).min() * 100),
+        "coverage": min(1.0, float(bars["t"][-1] - bars["t"][0] + step) / length),
+    }
+
+price_history = PriceHistory()
+atexit.register(price_history.close)
+
+async def record_price_history():
+    """Переносит свежий снимок рынка в историю цен (без обращения к API)."""
+    updated_at = market_snapshot.updated_at
+    if not updated_at or updated_at <= price_history.last_sample_at:
+        return
+    await asyncio.to_thread(price_history.record, market_snapshot.prices(), updated_at)
+
+# ---------------------- Скользящая статистика ----------------------------------
+
+class RollingWindow:
+    """
+    Цены монеты за последние length секунд с обновлением за O(1) на выборку.
+
+    Среднее и дисперсия лог-доходностей между соседними выборками ведутся методом
+    Уэлфорда (с удалением выпавших из окна), минимум и максимум цены — монотонными
+    очередями: в mins цены возрастают от начала к концу, в maxs — убывают.
+    """
+
+    __slots__ = ("length", "samples", "mins", "maxs", "n", "mean", "m2")
+
+    def __init__(self, length: float):
+        self.length = length
+        self.samples = deque()  # (t, цена)
+        self.mins = deque()
+        self.maxs = deque()
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _add_return(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def _remove_return(self, x: float):
+        if self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = (self.n * self.mean - x) / (self.n - 1)
+        self.m2 = max(0.0, self.m2 - (x - self.mean) * (x - mean))
+        self.mean = mean
+        self.n -= 1
+
+    def add(self, t: float, price: float):
+        samples = self.samples
+        if samples:
+            if t <= samples[-1][0]:
+                return
+            self._add_return(math.log(price / samples[-1][1]))
+        samples.append((t, price))
+        while self.mins and self.mins[-1][1] >= price:
+            self.mins.pop()
+        self.mins.append((t, price))
+        while self.maxs and self.maxs[-1][1] <= price:
+            self.maxs.pop()
+        self.maxs.append((t, price))
+
+        while t - samples[0][0] > self.length:
+            old_t, old_price = samples.popleft()
+            self._remove_return(math.log(samples[0][1] / old_price))
+            if self.mins[0][0] <= old_t:
+                self.mins.popleft()
+            if self.maxs[0][0] <= old_t:
+                self.maxs.popleft()
+
+    def stats(self):
+        """Метрики окна в процентах (как у volatility_metrics) или None, если выборок мало."""
+        if len(self.samples) < 2:
+            return None
+        first_t, first_price = self.samples[0]
+        last_t, last_price = self.samples[-1]
+        low, high = self.mins[0][1], self.maxs[0][1]
+        return {
+            "change": (last_price / first_price - 1) * 100,
+            # Стандартное отклонение доходностей, приведённое к длине окна: sqrt(m2 / n) * sqrt(n)
+            "stddev": math.sqrt(self.m2) * 100,
+            "range": (high / low - 1) * 100,
+            "low": low,
+            "high": high,
+            "coverage": min(1.0, (last_t - first_t) / self.length),
+        }
+
+class RollingStats:
+    """Скользящие окна ROLLING_WINDOWS по каждой отслеживаемой монете."""
+
+    def __init__(self, windows: dict = ROLLING_WINDOWS):
+        self.windows = windows
+        self._lock = threading.Lock()
+        self._coins = {}  # монета -> {окно: RollingWindow}
+
+    def update(self, prices: dict, t: float):
+        """Добавляет выборку цен (id монеты -> цена) в момент t."""
+        with self._lock:
+            for coin, price in prices.items():
+                if not price or price <= 0:
+                    continue
+                windows = self._coins.get(coin)
+                if windows is None:
+                    windows = self._coins[coin] = {w: RollingWindow(length) for w, length in self.windows.items()}
+                for window in windows.values():
+                    window.add(t, float(price))
+
+    def retain(self, coins: set):
+        with self._lock:
+            for coin in [c for c in self._coins if c not in coins]:
+                del self._coins[coin]
+
+    def warm_up(self, history: PriceHistory, coins, now: float = None):
+        """Заполняет окна по минутным барам истории цен, чтобы не ждать сутки после перезапуска."""
+        now = time.time() if now is None else now
+        tier = min(history.tiers, key=lambda name: history.tiers[name][0])
+        since = now - max(self.windows.values())
+        longest = max(self.windows, key=self.windows.get)
+        for coin in coins:
+            bars = history.bars(coin, tier, since, now)
+            if not len(bars):
+                continue
+            windows = {w: RollingWindow(length) for w, length in self.windows.items()}
+            for t, close in zip(bars["t"].tolist(), bars["close"].tolist()):
+                if close > 0:
+                    for window in windows.values():
+                        window.add(t, close)
+            with self._lock:
+                # Выборки, которые успели прийти из опроса рынка за время прогрева, идут после истории
+                current = self._coins.get(coin)
+                if current is not None:
+                    for t, price in current[longest].samples:
+                        for window in windows.values():
+                            window.add(t, price)
+                self._coins[coin] = windows
+
+    def get(self, coin: str) -> dict:
+        """Окно -> RollingWindow.stats() (None, если данных ещё нет)."""
+        with self._lock:
+            windows = self._coins.get(coin)
+            return {w: windows[w].stats() if windows else None for w in self.windows}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "coins": len(self._coins),
+                "samples": sum(len(w.samples) for ws in self._coins.values() for w in ws.values()),
+            }
+
+rolling_stats = RollingStats()
 
 # ---------------------- Новая функция handle_volatility -----------------------
-def handle_volatility(update: Update, context: CallbackContext):
+async def handle_volatility(update: Update, context: CallbackContext):
     user_id = str(update.message.from_user.id)
     logger.info(f"Пользователь {user_id} нажал 'Volatility'.")
 
     subs = get_user_subscriptions(user_id)
     if not subs:
-        update.message.reply_text(
+        await update.message.reply_text(
             "У вас нет подписок на криптовалюты. Сначала подпишитесь (🔔 Subscribe)."
         )
         return
 
-    # Запрашиваем у CoinGecko изменение цены за 1h,24h,7d,14d,30d
-    subs_str = ",".join(subs)
-    try:
-        markets_data = cg.get_coins_markets(
-            vs_currency="usd",
-            ids=subs_str,
-            price_change_percentage="1h,24h,7d,14d,30d"
-        )
-    except Exception as e:
-        logger.warning(f"Ошибка при запросе /coins/markets: {e}")
-        update.message.reply_text("Не удалось получить данные для расчёта волатильности.")
-        return
+    # Изменение и волатильность: короткие окна — из скользящей статистики, длинные — по своей
+    # истории цен; у CoinGecko (из снимка рынка) берём изменение только за окна, которые
+    # история ещё не покрывает
+    coins = [coin.lower() for coin in subs]
+    long_windows = {w: v for w, v in VOLATILITY_WINDOWS.items() if w not in ROLLING_WINDOWS}
+    history = {}
+    for c in coins:
+        metrics = rolling_stats.get(c)
+        metrics.update(await asyncio.to_thread(price_history.volatility, c, None, long_windows))
+        history[c] = {w: metrics.get(w) for w in VOLATILITY_WINDOWS}
+    need_market = [
+        c for c in coins
+        if any(m is None or m["coverage"] < VOLATILITY_MIN_COVERAGE for m in history[c].values())
+    ]
+    market_map = await get_market_data(need_market) if need_market else {}
 
-    market_map = {}
-    for item in markets_data:
-        cid = item.get("id", "").lower()
-        market_map[cid] = item
+    def fmt(p):
+        if p is None:
+            return "n/a"
+        return f"{p:+.2f}%"
 
     lines = []
+    has_metrics = False
     for coin in subs:
         c = coin.lower()
-        if c not in market_map:
+        data_item = market_map.get(c, {})
+        if all(m is None for m in history[c].values()) and not data_item:
             lines.append(f"{coin.capitalize()}: не найдены данные")
             continue
 
-        data_item = market_map[c]
-        ch_1h  = data_item.get("price_change_percentage_1h_in_currency", None)
-        ch_24h = data_item.get("price_change_percentage_24h_in_currency", None)
-        ch_7d  = data_item.get("price_change_percentage_7d_in_currency", None)
-        ch_14d = data_item.get("price_change_percentage_14d_in_currency", None)
-        ch_30d = data_item.get("price_change_percentage_30d_in_currency", None)
-
-        def fmt(p):
-            if p is None:
-                return "n/a"
-            return f"{p:+.2f}%"
-
-        line = (
-            f"{coin.capitalize()}:\n"
-            f"  1h:  {fmt(ch_1h)}\n"
-            f"  24h: {fmt(ch_24h)}\n"
-            f"  7d:  {fmt(ch_7d)}\n"
-            f"  14d: {fmt(ch_14d)}\n"
-            f"  30d: {fmt(ch_30d)}"
-        )
-        lines.append(line)
+        rows = [f"{coin.capitalize()}:"]
+        for window, metrics in history[c].items():
+            covered = metrics is not None and metrics["coverage"] >= VOLATILITY_MIN_COVERAGE
+            if covered:
+                change = metrics["change"]
+            else:
+                change = data_item.get(f"price_change_percentage_{window}_in_currency")
+            row = f"  {window + ':':<4} {fmt(change)}"
+            if covered:
+                has_metrics = True
+                row += f" · σ {metrics['stddev']:.2f}%"
+                if "atr" in metrics:
+                    row += f" · ATR {metrics['atr']:.2f}% · просадка {metrics['drawdown']:.2f}%"
+                else:
+                    row += f" · размах {metrics['range']:.2f}%"
+            rows.append(row)
+        lines.append("\n".join(rows))
 
     final_msg = "Динамика курсов (Volatility):\n\n" + "\n\n".join(lines)
-    update.message.reply_text(final_msg)
+    if has_metrics:
+        final_msg += (
+            "\n\nσ — разброс доходностей за период, размах — от минимума до максимума цены, "
+            "ATR — средний размах бара, просадка — наибольшее падение от максимума за период."
+        )
+    await update.message.reply_text(final_msg)
 
 # ---------------------- Логика кнопок: News, Price -----------------------------
 
-def handle_news(update: Update, context: CallbackContext):
+async def handle_news(update: Update, context: CallbackContext):
     user_id = str(update.message.from_user.id)
     logger.info(f"Пользователь {user_id} запросил News (вручную).")
 
     subscriptions = get_user_subscriptions(user_id)
     if not subscriptions:
-        update.message.reply_text("У вас нет подписок. Сначала подпишитесь (🔔 Subscribe).")
+        await update.message.reply_text("У вас нет подписок. Сначала подпишитесь (🔔 Subscribe).")
         return
 
-    all_news = fetch_all_news()
+    all_news = await fetch_all_news()
     if not all_news:
-        update.message.reply_text("Не удалось получить новости в данный момент.")
+        await update.message.reply_text("Не удалось получить новости в данный момент.")
         return
 
-    user_news = []
-    for item in all_news:
-        title = ""
-        url = ""
-        if isinstance(item, dict):
-            title = item.get("title", "").lower()
-            url = item.get("url", "") or item.get("link", "")
-        elif hasattr(item, 'title'):
-            title = item.title.lower()
-            url = item.link
-        else:
-            continue
-
-        if any(re.search(rf"\b{re.escape(sub)}\b", title) for sub in subscriptions):
-            user_news.append((title, url))
+    user_coins = set(subscriptions)
+    user_news = [item for item in all_news if item.coins & user_coins]
 
     if not user_news:
-        update.message.reply_text("Нет актуальных новостей по вашим подпискам.")
+        await update.message.reply_text("Нет актуальных новостей по вашим подпискам.")
         return
 
-    for title, url in user_news:
-        sentiment = get_sentiment_label(title)
-        if sentiment == "POSITIVE":
-            sentiment_text = "🟢 Positive"
-        elif sentiment == "NEGATIVE":
-            sentiment_text = "🔴 Negative"
-        else:
-            sentiment_text = "<i>Neutral</i>"
-
-        msg_text = (
-            f"<b>НОВОСТЬ:</b>\n{title}\n\n"
-            f"<b>Сентимент:</b> {sentiment_text}\n\n"
-            f"<a href='{url}'>Ссылка на источник</a>"
-        )
-        try:
-            update.message.reply_text(
-                msg_text,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-        except Exception as e:
-            logger.warning(f"Ошибка отправки новости пользователю {user_id}: {e}")
+    for msg_text in render_news_digest(user_news, "Новости по вашим подпискам", coins_filter=user_coins):
+        send_telegram_message(update.effective_chat.id, msg_text)
 
-def handle_price(update: Update, context: CallbackContext):
+async def handle_price(update: Update, context: CallbackContext):
     user_id = str(update.message.from_user.id)
     logger.info(f"Пользователь {user_id} запросил Price.")
 
     subs = get_user_subscriptions(user_id)
     if not subs:
-        update.message.reply_text("У вас нет подписок. Сначала подпишитесь (🔔 Subscribe).")
+        await update.message.reply_text("У вас нет подписок. Сначала подпишитесь (🔔 Subscribe).")
         return
 
     subs = list(set(subs))
-    try:
-        prices = cg.get_price(ids=",".join(subs), vs_currencies="usd")
-    except Exception as e:
-        logger.warning(f"Ошибка при получении цены: {e}")
-        update.message.reply_text("Произошла ошибка при получении данных.")
-        return
-
+    prices = await fetch_crypto_prices([coin.lower() for coin in subs])
     if not prices:
-        update.message.reply_text("Не удалось получить цены. Проверьте названия криптовалют.")
+        await update.message.reply_text("Не удалось получить цены. Проверьте названия криптовалют.")
         return
 
     lines = []
@@ -638,47 +3282,121 @@ def handle_price(update: Update, context: CallbackContext):
         else:
             lines.append(f"{coin.capitalize()}: не найдена")
 
-    update.message.reply_text("\n".join(lines))
+    await update.message.reply_text("\n".join(lines))
+
+# ---------------------- Подборки новостей -------------------------------------
+
+SENTIMENT_LABELS = {
+    "POSITIVE": "🟢 Positive",
+    "NEUTRAL": "<i>Neutral</i>",
+    "NEGATIVE": "🔴 Negative",
+}
+# Длиннее заголовки обрезаем, чтобы одна строка гарантированно влезала в сообщение
+DIGEST_MAX_TITLE_LENGTH = 300
+
+def coin_display_name(coin: str) -> str:
+    _, name = coin_index.info.get(coin, ("", ""))
+    return name or coin.capitalize()
+
+def render_news_digest(items: list, header: str, coins_filter: set = None, max_items: int = DIGEST_MAX_ITEMS,
+                       limit: int = TELEGRAM_MAX_MESSAGE_LENGTH) -> list:
+    """
+    Собирает новости (NewsItem) в как можно меньше HTML-сообщений не длиннее limit.
+    Новости группируются по монете (первой по алфавиту из упомянутых; если передан
+    coins_filter — только среди них), внутри — по тональности. Истории, о которых пишут
+    несколько источников, идут первыми и помечаются числом источников. Если группа
+    не влезла, в следующем сообщении её заголовки повторяются.
+    """
+    items = sorted(items, key=lambda item: -len(item.sources))
+    shown = items[:max_items] if max_items else items
+    groups = {}
+    for item in shown:
+        coins = item.coins & coins_filter if coins_filter is not None else item.coins
+        coin = min(coins) if coins else ""
+        title, url, sentiment = item.title, item.url, item.sentiment
+        if len(title) > DIGEST_MAX_TITLE_LENGTH:
+            title = title[:DIGEST_MAX_TITLE_LENGTH - 1] + "…"
+        if url:
+            line = f"• <a href='{html.escape(url, quote=True)}'>{html.escape(title)}</a>"
+        else:
+            line = f"• {html.escape(title)}"
+        if len(item.sources) > 1:
+            line += f" <i>(источников: {len(item.sources)})</i>"
+        groups.setdefault(coin, {}).setdefault(sentiment, []).append(line)
+
+    # Сначала монеты, о которых больше всего новостей; новости без монеты — в конце
+    order = sorted(groups, key=lambda c: (c == "", -sum(len(v) for v in groups[c].values()), c))
+
+    messages = []
+    title_line = f"<b>{html.escape(header)}</b>"
+    cur = [title_line]
+    cur_len = len(title_line)
+    cur_coin = cur_sentiment = None
+    for coin in order:
+        coin_header = f"<b>{html.escape(coin_display_name(coin).upper())}</b>" if coin else "<b>ДРУГОЕ</b>"
+        for sentiment in ("POSITIVE", "NEUTRAL", "NEGATIVE"):
+            for line in groups[coin].get(sentiment, []):
+                while True:
+                    block = []
+                    if cur_coin != coin:
+                        block += ["", coin_header]
+                    if cur_coin != coin or cur_sentiment != sentiment:
+                        block.append(SENTIMENT_LABELS[sentiment])
+                    block.append(line)
+                    block_len = sum(len(b) + 1 for b in block)
+                    if cur_len + block_len <= limit or len(cur) == 1:
+                        break
+                    messages.append("\n".join(cur))
+                    cur = [title_line]
+                    cur_len = len(title_line)
+                    cur_coin = cur_sentiment = None
+                cur += block
+                cur_len += block_len
+                cur_coin, cur_sentiment = coin, sentiment
+
+    hidden = len(items) - len(shown)
+    if hidden > 0:
+        more = f"\n<i>…и ещё новостей: {hidden}</i>"
+        if cur_len + len(more) + 1 > limit:
+            messages.append("\n".join(cur))
+            cur = [title_line]
+        cur.append(more)
+    messages.append("\n".join(cur))
+    return messages
 
 # ---------------------- Рассылка новостей в канал -----------------------------
 
 def process_and_send_news_to_channel(context: CallbackContext, all_news: list):
-    logger.info(f"Отправка {len(all_news)} новостей в канал {CHANNEL_ID}.")
-    for item in all_news:
-        title = ""
-        url = ""
-        if isinstance(item, dict):
-            title = item.get("title", "").lower()
-            url = item.get("url", "") or item.get("link", "")
-        elif hasattr(item, 'title'):
-            title = item.title.lower()
-            url = item.link
-        else:
-            continue
+    messages = render_news_digest(all_news, "Свежие новости")
+    logger.info(f"Отправка {len(all_news)} новостей в канал {CHANNEL_ID} ({len(messages)} сообщений).")
+    for msg_text in messages:
+        send_telegram_message(CHANNEL_ID, msg_text)
 
-        sentiment = get_sentiment_label(title)
-        if sentiment == "POSITIVE":
-            sentiment_text = "🟢 Positive"
-        elif sentiment == "NEGATIVE":
-            sentiment_text = "🔴 Negative"
-        else:
-            sentiment_text = "<i>Neutral</i>"
+# ---------------------- Личные подборки новостей ------------------------------
 
-        msg_text = (
-            f"<b>НОВОСТЬ:</b>\n{title}\n\n"
-            f"<b>Сентимент:</b> {sentiment_text}\n\n"
-            f"<a href='{url}'>Ссылка на источник</a>"
-        )
-        try:
-            context.bot.send_message(
-                chat_id=CHANNEL_ID,
-                text=msg_text,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-            time.sleep(2)
-        except Exception as e:
-            logger.warning(f"Не удалось отправить новость в канал: {e}")
+def build_personal_digests(news: list) -> dict:
+    """
+    Раскладывает новости по подписчикам через обратный индекс монета -> users:
+    user_id -> [NewsItem, ...]. Стоимость O(новости + совпадения), а не O(users × новости).
+    """
+    digests = {}
+    for item in news:
+        recipients = set()
+        for coin in item.coins:
+            recipients |= subscription_store.users_for(coin)
+        for user_id in recipients:
+            digests.setdefault(user_id, []).append(item)
+    return digests
+
+def deliver_personal_news(news: list):
+    digests = build_personal_digests(news)
+    if not digests:
+        return
+    logger.info(f"Отправка личных подборок {len(digests)} пользователям.")
+    for user_id, items in digests.items():
+        user_coins = set(subscription_store.get(user_id))
+        for msg_text in render_news_digest(items, "Новости по вашим подпискам", coins_filter=user_coins):
+            send_telegram_message(user_id, msg_text)
 
 # ---------------------- (Опционально) Проверка изменения цен -------------------
 
@@ -693,115 +3411,801 @@ def load_price_thresholds() -> dict:
             thresholds[crypto] = 5.0
     return thresholds
 
-def load_previous_prices() -> dict:
-    if not os.path.exists(PREVIOUS_PRICES_FILE):
-        return {}
-    try:
-        with open(PREVIOUS_PRICES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.warning(f"Не удалось прочитать {PREVIOUS_PRICES_FILE}: {e}")
-        return {}
-
-def save_previous_prices(prices: dict):
-    try:
-        with open(PREVIOUS_PRICES_FILE, "w", encoding="utf-8") as f:
-            json.dump(prices, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logger.warning(f"Не удалось записать {PREVIOUS_PRICES_FILE}: {e}")
-
-def fetch_crypto_prices(cryptos: list = None, vs_currency: str = "usd") -> dict:
+async def fetch_crypto_prices(cryptos: list = None, vs_currency: str = "usd") -> dict:
     if not cryptos:
         cryptos = ["bitcoin", "ethereum"]
+    if vs_currency == "usd":
+        # Цены в USD уже есть в снимке рынка
+        markets = await get_market_data(cryptos)
+        return {
+            coin: {"usd": item["current_price"]}
+            for coin, item in markets.items()
+            if item.get("current_price") is not None
+        }
     try:
-        prices = cg.get_price(ids=cryptos, vs_currencies=vs_currency)
+        prices = await cg.get_price(ids=cryptos, vs_currencies=vs_currency)
         logger.info(f"Получены цены: {prices}")
         return prices
     except Exception as e:
         logger.warning(f"Ошибка при запросе цен CoinGecko: {e}")
         return {}
 
-def check_price_changes(context: CallbackContext):
-    thresholds = load_price_thresholds()
-    current_prices = fetch_crypto_prices(list(thresholds.keys()))
-    if not current_prices:
-        logger.warning("Не удалось получить текущие цены для проверки.")
+class PriceAlertEngine:
+    """
+    Правила оповещений (чат, монета, порог в %, окно) в столбцах NumPy.
+
+    Снимок рынка проверяется по всем правилам одним векторным проходом: цены и изменения
+    монет собираются в матрицу [монета, окно], каждому правилу достаётся своя ячейка,
+    а маска срабатываний считается сразу для всех строк. Чаты и монеты хранятся
+    номерами в словарях, удаление переносит на место строки последнюю.
+    Правила читаются из хранилища при старте, изменения сразу уходят в хранилище.
+    """
+
+    _COLUMNS = ("_chat", "_coin", "_window", "_threshold", "_ref_price", "_last_fired", "_armed")
+
+    def __init__(self, backend, capacity: int = 1024):
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._capacity = capacity
+        self._last_eval_ms = None
+        self._load()
+        logger.info(f"Загружено правил оповещений о ценах: {self._size}.")
+
+    def _load(self):
+        self._backend_version = self.backend.alert_rules_version()
+        self._size = 0
+        self._chat = np.zeros(self._capacity, dtype=np.int32)
+        self._coin = np.zeros(self._capacity, dtype=np.int32)
+        self._window = np.zeros(self._capacity, dtype=np.int8)
+        self._threshold = np.zeros(self._capacity, dtype=np.float64)
+        self._ref_price = np.full(self._capacity, np.nan)
+        self._last_fired = np.zeros(self._capacity, dtype=np.float64)
+        self._armed = np.ones(self._capacity, dtype=bool)
+        self._index = {}  # (chat_id, coin, window) -> номер строки
+        self._chats, self._chat_ids = [], {}
+        self._coins, self._coin_ids = [], {}
+        for rule in self.backend.load_alert_rules():
+            if rule["window"] not in ALERT_WINDOWS:
+                continue
+            row = self._append(rule["chat_id"], rule["coin"], rule["window"], rule["threshold"])
+            if rule.get("ref_price") is not None:
+                self._ref_price[row] = rule["ref_price"]
+            self._last_fired[row] = rule.get("last_fired_at") or 0.0
+            self._armed[row] = bool(rule.get("armed", True))
+
+    def reload_if_changed(self) -> bool:
+        with self._lock:
+            if self.backend.alert_rules_version() == self._backend_version:
+                return False
+            self._load()
+        return True
+
+    def _note_version(self, version):
+        # Как у подписок: своё изменение не требует перечитывать правила
+        if version is not None and version == self._backend_version + 1:
+            self._backend_version = version
+
+    @staticmethod
+    def _intern(value: str, values: list, ids: dict) -> int:
+        idx = ids.get(value)
+        if idx is None:
+            idx = ids[value] = len(values)
+            values.append(value)
+        return idx
+
+    def _append(self, chat_id: str, coin: str, window: str, threshold: float) -> int:
+        if self._size == len(self._chat):
+            for name in self._COLUMNS:
+                column = getattr(self, name)
+                grown = np.empty(len(column) * 2, dtype=column.dtype)
+                grown[:self._size] = column[:self._size]
+                setattr(self, name, grown)
+        row = self._size
+        self._size += 1
+        self._chat[row] = self._intern(chat_id, self._chats, self._chat_ids)
+        self._coin[row] = self._intern(coin, self._coins, self._coin_ids)
+        self._window[row] = ALERT_WINDOWS.index(window)
+        self._threshold[row] = threshold
+        self._ref_price[row] = np.nan
+        self._last_fired[row] = 0.0
+        self._armed[row] = True
+        self._index[(chat_id, coin, window)] = row
+        return row
+
+    def _key(self, row: int) -> tuple:
+        return (
+            self._chats[self._chat[row]],
+            self._coins[self._coin[row]],
+            ALERT_WINDOWS[self._window[row]],
+        )
+
+    def _delete(self, row: int):
+        del self._index[self._key(row)]
+        last = self._size - 1
+        if row != last:
+            for name in self._COLUMNS:
+                column = getattr(self, name)
+                column[row] = column[last]
+            self._index[self._key(row)] = row
+        self._size = last
+
+    def add_rule(self, chat_id: str, coin: str, threshold: float, window: str = "ref",
+                 ref_price: float = None) -> bool:
+        """Добавляет или заменяет правило; False, если у чата уже слишком много правил."""
+        chat_id = str(chat_id)
+        with self._lock:
+            row = self._index.get((chat_id, coin, window))
+            if row is None:
+                chat_idx = self._chat_ids.get(chat_id)
+                if chat_idx is not None and np.count_nonzero(self._chat[:self._size] == chat_idx) >= ALERT_MAX_RULES_PER_USER:
+                    return False
+                row = self._append(chat_id, coin, window, threshold)
+            else:
+                self._threshold[row] = threshold
+                self._ref_price[row] = np.nan
+                self._last_fired[row] = 0.0
+                self._armed[row] = True
+            if ref_price is not None:
+                self._ref_price[row] = ref_price
+            self._note_version(self.backend.save_alert_rule({
+                "chat_id": chat_id, "coin": coin, "window": window, "threshold": threshold,
+                "ref_price": ref_price, "last_fired_at": 0.0, "armed": True,
+            }))
+        return True
+
+    def remove_rule(self, chat_id: str, coin: str, window: str = None) -> bool:
+        """Удаляет правило по монете (все окна, если window не указано)."""
+        chat_id = str(chat_id)
+        with self._lock:
+            windows = ALERT_WINDOWS if window is None else (window,)
+            rows = [self._index[k] for k in ((chat_id, coin, w) for w in windows) if k in self._index]
+            if not rows:
+                return False
+            for row in sorted(rows, reverse=True):
+                self._delete(row)
+            self._note_version(self.backend.remove_alert_rules(chat_id, coin, window))
+        return True
+
+    def has_rule(self, chat_id: str, coin: str, window: str = "ref") -> bool:
+        with self._lock:
+            return (str(chat_id), coin, window) in self._index
+
+    def rules_for(self, chat_id: str) -> list:
+        """[(монета, окно, порог)] правил чата."""
+        with self._lock:
+            chat_idx = self._chat_ids.get(str(chat_id))
+            if chat_idx is None:
+                return []
+            rows = np.flatnonzero(self._chat[:self._size] == chat_idx)
+            return sorted(
+                (self._coins[self._coin[r]], ALERT_WINDOWS[self._window[r]], float(self._threshold[r]))
+                for r in rows
+            )
+
+    def coins(self) -> set:
+        """Монеты, по которым есть хотя бы одно правило."""
+        with self._lock:
+            return {self._coins[i] for i in np.unique(self._coin[:self._size])}
+
+    def evaluate(self, markets: dict, now: float = None) -> list:
+        """
+        Проверяет все правила по снимку рынка (id монеты -> ответ /coins/markets).
+        Возвращает сработавшие правила: [(chat_id, монета, окно, цена, изменение в %)].
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            started = time.perf_counter()
+            n = self._size
+            if not n:
+                return []
+            prices = np.full(len(self._coins), np.nan)
+            changes = np.full((len(self._coins), len(ALERT_WINDOWS)), np.nan)
+            for i, coin in enumerate(self._coins):
+                item = markets.get(coin)
+                if not item:
+                    continue
+                if item.get("current_price") is not None:
+                    prices[i] = item["current_price"]
+                for w, window in enumerate(ALERT_WINDOWS[1:], 1):
+                    value = item.get(f"price_change_percentage_{window}_in_currency")
+                    if value is not None:
+                        changes[i, w] = value
+
+            coin = self._coin[:n]
+            window = self._window[:n]
+            threshold = self._threshold[:n]
+            ref_price = self._ref_price[:n]
+            last_fired = self._last_fired[:n]
+            armed = self._armed[:n]
+
+            price = prices[coin]
+            is_ref = window == 0
+            # Правила "ref" без опорной цены получают текущую и начинают отсчёт с неё
+            init = is_ref & np.isnan(ref_price) & ~np.isnan(price)
+            ref_price[init] = price[init]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                change = np.where(is_ref, (price - ref_price) / ref_price * 100, changes[coin, window])
+            magnitude = np.abs(change)
+            valid = np.isfinite(magnitude)
+
+            rearm = valid & ~armed & (magnitude < threshold * ALERT_REARM_RATIO)
+            armed[rearm] = True
+            fire = valid & armed & (magnitude >= threshold) & (now - last_fired >= ALERT_COOLDOWN)
+            armed[fire] = False
+            last_fired[fire] = now
+            moved = fire & is_ref
+            ref_price[moved] = price[moved]
+
+            fired = [
+                (self._chats[self._chat[r]], self._coins[coin[r]], ALERT_WINDOWS[window[r]],
+                 float(price[r]), float(change[r]))
+                for r in np.flatnonzero(fire)
+            ]
+            changed = np.flatnonzero(init | rearm | fire)
+            self._last_eval_ms = round((time.perf_counter() - started) * 1000, 2)
+            if len(changed):
+                self._note_version(self.backend.save_alert_states([
+                    dict(zip(("chat_id", "coin", "window"), self._key(r)),
+                         ref_price=None if np.isnan(ref_price[r]) else float(ref_price[r]),
+                         last_fired_at=float(last_fired[r]), armed=bool(armed[r]))
+                    for r in changed
+                ]))
+        return fired
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rules": self._size,
+                "chats": len(np.unique(self._chat[:self._size])),
+                "coins": len(self.coins()),
+                "last_eval_ms": self._last_eval_ms,
+            }
+
+alert_engine = PriceAlertEngine(storage)
+
+def setup_channel_alerts():
+    """Пороги из окружения (PRICE_THRESHOLD_*) — правила "ref" для канала."""
+    if not CHANNEL_ID:
         return
+    # Опорные цены прошлых версий бота, чтобы не потерять отсчёт при обновлении
+    previous_prices = storage.load_prices()
+    for crypto, threshold in load_price_thresholds().items():
+        rules = {(coin, window): t for coin, window, t in alert_engine.rules_for(CHANNEL_ID)}
+        if rules.get((crypto, "ref")) != threshold:
+            alert_engine.add_rule(CHANNEL_ID, crypto, threshold, "ref", previous_prices.get(crypto))
 
-    previous_prices = load_previous_prices()
-    alerts = []
-
-    for crypto, threshold in thresholds.items():
-        now_price = current_prices.get(crypto, {}).get("usd")
-        old_price = previous_prices.get(crypto)
-        if now_price and old_price:
-            change = (now_price - old_price) / old_price * 100
-            if abs(change) >= threshold:
-                direction = "↑" if change > 0 else "↓"
-                alert = (
-                    f"⚠️ Изменение цены {crypto.capitalize()}: {now_price:.2f} USD\n"
-                    f"Изменение: {direction}{abs(change):.2f}%"
-                )
-                alerts.append(alert)
+def format_price_alert(coin: str, window: str, price: float, change: float) -> str:
+    direction = "↑" if change > 0 else "↓"
+    period = "" if window == "ref" else f" за {window}"
+    return (
+        f"⚠️ Изменение цены {coin.capitalize()}: {price:.2f} USD\n"
+        f"Изменение: {direction}{abs(change):.2f}%{period}"
+    )
+
+async def check_price_changes(context: CallbackContext):
+    coins = alert_engine.coins()
+    if not coins:
+        return
+    markets = await get_market_data(sorted(coins))
+    if not markets:
+        logger.warning("Не удалось получить текущие цены для проверки.")
+        return
 
-        # Обновляем «старую» цену
-        if now_price:
-            previous_prices[crypto] = now_price
+    # Изменения за короткие окна — свои, из скользящей статистики (свежее, чем у CoinGecko)
+    for coin, item in markets.items():
+        local = {
+            f"price_change_percentage_{w}_in_currency": m["change"]
+            for w, m in rolling_stats.get(coin).items()
+            if m is not None and m["coverage"] >= VOLATILITY_MIN_COVERAGE
+        }
+        if local:
+            markets[coin] = dict(item, **local)
 
-    if alerts:
-        logger.info(f"Отправка {len(alerts)} оповещений об изменении цен.")
-        for a in alerts:
-            context.bot.send_message(chat_id=CHANNEL_ID, text=a)
-        save_previous_prices(previous_prices)
-    else:
+    fired = await asyncio.to_thread(alert_engine.evaluate, markets)
+    if not fired:
         logger.info("Нет значительных изменений цен.")
+        return
+
+    by_chat = {}
+    for chat_id, coin, window, price, change in fired:
+        by_chat.setdefault(chat_id, []).append(format_price_alert(coin, window, price, change))
+    logger.info(f"Отправка {len(fired)} оповещений об изменении цен в {len(by_chat)} чатов.")
+    for chat_id, alerts in by_chat.items():
+        send_telegram_message(chat_id, "\n\n".join(alerts), parse_mode=None)
 
 # ---------------------- Планировщик --------------------------------------------
 
-def scheduled_tasks(updater: Updater):
-    while True:
+class ScheduledJob:
+    __slots__ = (
+        "name", "func", "interval", "base_interval", "min_interval", "max_interval",
+        "jitter", "adaptive", "exclusive", "lease", "leased", "running", "runs", "errors", "consecutive_errors",
+        "last_duration", "next_run_at", "task",
+    )
+
+    def __init__(self, name, func, interval, min_interval, max_interval, jitter, adaptive, exclusive, lease):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.base_interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.adaptive = adaptive
+        self.exclusive = exclusive
+        self.lease = lease
+        self.leased = False
+        self.running = False
+        self.runs = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_duration = None
+        self.next_run_at = None
+        self.task = None
+
+class JobScheduler:
+    """
+    Независимые периодические задачи, у каждой свой интервал со случайным разбросом ±jitter.
+
+    Каждая задача крутится в своей asyncio-задаче: следующий запуск планируется только
+    после окончания текущего, поэтому запуски одной задачи не перекрываются, а медленная
+    задача не задерживает остальные. Адаптивная задача возвращает True, если нашла
+    что-то новое: тогда интервал сокращается (до min_interval), иначе растёт (до
+    max_interval). При ошибках интервал удваивается, после успеха возвращается к исходному.
+
+    Исключительные (exclusive) задачи при общем backend выполняет только воркер, который
+    держит аренду задачи в хранилище. Аренда продлевается после каждого запуска до
+    следующего с запасом JOB_LEASE_GRACE; если воркер пропал, её забирает другой.
+    Несколько задач могут делить одну аренду (lease): тогда их все выполняет один воркер.
+    """
+
+    def __init__(self, backend=None, owner: str = WORKER_ID):
+        self.backend = backend
+        self.owner = owner
+        self._jobs = {}
+
+    def add_job(self, name: str, func, interval: float, first_run: float = 0.0,
+                min_interval: float = None, max_interval: float = None,
+                jitter: float = SCHEDULER_JITTER, adaptive: bool = False, exclusive: bool = False,
+                lease: str = None):
+        """func — корутинная функция без аргументов; lease — имя аренды, по умолчанию своя."""
+        job = ScheduledJob(
+            name, func, interval,
+            min_interval if min_interval is not None else interval,
+            max_interval if max_interval is not None else interval,
+            jitter, adaptive, exclusive, f"job:{lease or name}",
+        )
+        job.next_run_at = time.monotonic() + first_run
+        self._jobs[name] = job
+
+    def start(self):
+        for job in self._jobs.values():
+            if job.task is None:
+                job.task = asyncio.create_task(self._loop(job), name=f"job:{job.name}")
+
+    async def stop(self):
+        tasks = [job.task for job in self._jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Отдаём аренды сразу, чтобы другой воркер не ждал их истечения
+        for job in self._jobs.values():
+            if job.leased:
+                await asyncio.to_thread(self.backend.release_lease, job.lease, self.owner)
+                job.leased = False
+
+    async def _hold_lease(self, job: ScheduledJob, ttl: float) -> bool:
+        if self.backend is None or not job.exclusive:
+            return True
+        try:
+            held = await asyncio.to_thread(self.backend.acquire_lease, job.lease, self.owner, ttl)
+        except Exception as e:
+            logger.warning(f"Не удалось взять аренду задачи {job.name}: {e}")
+            held = False
+        if held and not job.leased:
+            logger.info(f"Задачу {job.name} выполняет этот воркер ({self.owner}).")
+        job.leased = held
+        return held
+
+    async def _loop(self, job: ScheduledJob):
+        while True:
+            await asyncio.sleep(max(0.0, job.next_run_at - time.monotonic()))
+            await self._execute(job)
+
+    async def _execute(self, job: ScheduledJob):
+        if not await self._hold_lease(job, job.interval * (1 + job.jitter) + JOB_LEASE_GRACE):
+            # Задачу выполняет другой воркер; проверим, жив ли он, через интервал
+            job.next_run_at = time.monotonic() + job.interval * (1 + random.uniform(-job.jitter, job.jitter))
+            return
+
+        started = time.monotonic()
+        job.running = True
+        try:
+            active, failed = await job.func(), False
+        except Exception as e:
+            logger.error(f"Ошибка в задаче {job.name}: {e}", exc_info=True)
+            active, failed = False, True
+        finally:
+            job.running = False
+
+        job.runs += 1
+        job.last_duration = round(time.monotonic() - started, 3)
+        if failed:
+            job.errors += 1
+            job.consecutive_errors += 1
+            job.interval = min(job.max_interval, max(job.interval, job.base_interval) * 2)
+        else:
+            if job.consecutive_errors:
+                job.consecutive_errors = 0
+                job.interval = job.base_interval
+            if job.adaptive:
+                factor = ADAPTIVE_SPEEDUP if active else ADAPTIVE_SLOWDOWN
+                job.interval = min(job.max_interval, max(job.min_interval, job.interval * factor))
+        delay = job.interval * (1 + random.uniform(-job.jitter, job.jitter))
+        job.next_run_at = time.monotonic() + delay
+        await self._hold_lease(job, delay + JOB_LEASE_GRACE)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            name: {
+                "interval": round(job.interval),
+                "next_in": None if job.running else round(job.next_run_at - now),
+                "running": job.running,
+                "leased": job.leased,
+                "runs": job.runs,
+                "errors": job.errors,
+                "last_duration": job.last_duration,
+            }
+            for name, job in self._jobs.items()
+        }
+
+# Аренды задач нужны только при нескольких воркерах на общей базе
+scheduler = JobScheduler(storage if WORKER_COUNT > 1 else None)
+
+def deliver_news(context: CallbackContext, news: list) -> int:
+    """
+    Рассылает ещё не отправленные истории в канал и подписчикам; возвращает их число.
+    Новости, похожие на недавно разосланные, только отмечаются как просмотренные.
+    Внутри нет await, поэтому проверка и отметка новостей не перемежаются с другими
+    источниками и одна новость из двух источников не уйдёт дважды. При нескольких
+    воркерах все источники опрашивает владелец одной аренды "news", так что индекс
+    историй (он только в памяти) и проверка отправленных не делятся между процессами.
+    """
+    if WORKER_COUNT > 1:
+        # Рассылку могли вести другие воркеры, пока аренда была у них
+        seen_news.reload()
+    new_news = seen_news.filter_new(news)
+    stories = story_index.filter_new(new_news)
+    if stories:
+        process_and_send_news_to_channel(context, stories)
+        if PERSONAL_NEWS_ENABLED:
+            deliver_personal_news(stories)
+    if new_news:
+        seen_news.mark_seen(new_news)
+    return len(stories)
+
+async def poll_news_source(context: CallbackContext, source: NewsSource) -> bool:
+    items = await source.fetch(raise_errors=True)
+    items = await asyncio.to_thread(prepare_news, items)
+    new_count = deliver_news(context, items)
+    await asyncio.to_thread(seen_news.save)
+    logger.info(f"{source.name}: новых новостей {new_count} из {len(items)}.")
+    return new_count > 0
+
+async def sync_shared_state():
+    """Изменения других воркеров: подписки, правила оповещений и сообщения в чаты этого воркера."""
+    subscription_store.reload_if_changed()
+    alert_engine.reload_if_changed()
+    message_sender.sync_outbox()
+
+async def log_stats():
+    logger.info(f"Воркер {WORKER_ID} ({WORKER_INDEX + 1} из {WORKER_COUNT}).")
+    logger.info(f"Кэш CoinGecko: {cg.stats()}")
+    logger.info(f"Очередь отправки: {message_sender.stats()}")
+    logger.info(f"Кэш тональности: {sentiment_service.stats()}")
+    logger.info(f"Условные запросы к источникам: {news_fetcher.stats()}")
+    logger.info(f"Источники новостей: {news_source_stats()}")
+    logger.info(f"Истории новостей: {story_index.stats()}")
+    logger.info(f"Задачи планировщика: {scheduler.stats()}")
+    logger.info(f"Оповещения о ценах: {alert_engine.stats()}")
+    logger.info(f"История цен: {price_history.stats()}")
+    logger.info(f"Скользящая статистика: {rolling_stats.stats()}")
+    if TELEGRAM_MODE == "webhook":
+        logger.info(f"Вебхук: {webhook_server.stats()}")
+
+def setup_scheduled_jobs(context: CallbackContext):
+    for source in NEWS_SOURCES:
+        scheduler.add_job(
+            f"news:{source.name}",
+            lambda source=source: poll_news_source(context, source),
+            source.poll_interval,
+            min_interval=source.min_poll_interval,
+            max_interval=source.max_poll_interval,
+            adaptive=True,
+            exclusive=True,
+            lease="news",
+        )
+    scheduler.add_job("market", poll_market_data, MARKET_POLL_INTERVAL)
+    scheduler.add_job("price_history", record_price_history, MARKET_POLL_INTERVAL, exclusive=True)
+    scheduler.add_job(
+        "price_alerts", lambda: check_price_changes(context), PRICE_CHECK_INTERVAL, exclusive=True,
+    )
+    scheduler.add_job("stats", log_stats, STATS_LOG_INTERVAL, first_run=STATS_LOG_INTERVAL)
+    if WORKER_COUNT > 1:
+        scheduler.add_job("shared_state", sync_shared_state, SHARED_STATE_SYNC_INTERVAL, jitter=0)
+
+# ---------------------- Вебхук -------------------------------------------------
+
+_HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+class WebhookServer:
+    """
+    Встроенный HTTP/1.1-сервер на asyncio для приёма апдейтов Telegram (вебхук).
+
+    Принимает только POST на path с верным заголовком X-Telegram-Bot-Api-Secret-Token.
+    Апдейт кладётся в ограниченную очередь, которую разбирают workers обработчиков;
+    если очередь полна, отвечаем 503 и Telegram повторит доставку позже. GET на
+    любой путь — проверка живости для балансировщика или обратного прокси.
+    """
+
+    def __init__(self, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET_TOKEN,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = HANDLER_CONCURRENCY):
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.application = None
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._server = None
+        self.port = None
+        self._tasks = []
+        self._stats = {"accepted": 0, "rejected": 0, "queue_full": 0, "errors": 0}
+
+    async def start(self, application: Application, host: str, port: int, reuse_port: bool = WORKER_COUNT > 1):
+        """
+        reuse_port (SO_REUSEPORT) позволяет нескольким воркерам на одной машине слушать
+        один порт, ядро распределяет соединения между ними. Где его нет, каждому воркеру
+        нужен свой PORT.
+        """
+        self.application = application
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port,
+            reuse_port=reuse_port and hasattr(socket, "SO_REUSEPORT") or None,
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Вебхук слушает {host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.application.process_update(update)
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         try:
-            logger.info("Запуск периодической задачи: получение новостей и проверка цен.")
-            all_news = fetch_all_news()
-            if all_news:
-                process_and_send_news_to_channel(updater.dispatcher, all_news)
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), WEBHOOK_READ_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split(" ")
+                if len(parts) != 3:
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+                method, target, version = parts
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
 
-            check_price_changes(updater.dispatcher)
+                if "transfer-encoding" in headers:
+                    await self._respond(writer, 411, keep_alive=False)
+                    break
+                length = headers.get("content-length", "0")
+                # int() пропустил бы "-1", "+5" и " 5"; длина — только цифры
+                if not (length.isascii() and length.isdigit()):
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+                length = int(length)
+                if length > WEBHOOK_MAX_BODY:
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), WEBHOOK_READ_TIMEOUT)
 
-            logger.info(f"Задачи выполнены. Ждем {POLL_INTERVAL} секунд.")
-            time.sleep(POLL_INTERVAL)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status = self._dispatch(method, target.split("?", 1)[0], headers, body)
+                await self._respond(writer, status, keep_alive, with_body=method != "HEAD")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    def _dispatch(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        if method in ("GET", "HEAD"):
+            return 200
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self._stats["rejected"] += 1
+            logger.warning("Апдейт с неверным секретным токеном отклонён.")
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
         except Exception as e:
-            logger.error(f"Ошибка в планировщике: {e}", exc_info=True)
-            time.sleep(60)
+            logger.warning(f"Не удалось разобрать апдейт: {e}")
+            return 400
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self._stats["queue_full"] += 1
+            return 503
+        self._stats["accepted"] += 1
+        return 200
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool, with_body: bool = True):
+        """Ответ с текстом статуса в теле; на HEAD (with_body=False) — только заголовки."""
+        body = _HTTP_REASONS[status].encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_HTTP_REASONS[status]}\r\n"
+            f"Content-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + (body if with_body else b"")
+        )
+        await writer.drain()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+webhook_server = WebhookServer()
+
+async def run_application(application: Application, webhook: bool = True):
+    """
+    Запуск без getUpdates до SIGINT/SIGTERM: со встроенным вебхуком или, для воркеров
+    кроме первого в режиме polling, только фоновые задачи и отправка сообщений.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    if webhook:
+        await webhook_server.start(application, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    try:
+        if webhook and WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        elif webhook:
+            logger.warning("WEBHOOK_URL не задан, вебхук в Telegram не регистрируем.")
+        await stop.wait()
+    finally:
+        await webhook_server.stop()
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
 
 # ---------------------- main() ------------------------------------------------
 
-def main():
-    global bot_context
-    # Сначала загружаем список поддерживаемых монет (CoinGecko)
-    load_supported_coins()
+async def warm_up():
+    """
+    Догрузка после старта, пока бот уже отвечает: справочник монет и скользящая статистика
+    с диска, словарь VADER. Обновление справочника из сети — задача coin_list.
+    """
+    async def timed(name, func, *args):
+        with startup.phase(name):
+            return await asyncio.to_thread(func, *args)
+
+    results = await asyncio.gather(
+        timed("coin_index", coin_index.load),
+        timed("rolling_stats", rolling_stats.warm_up, price_history, tracked_coins()),
+        timed("sentiment", sentiment_service.analyzer),
+        return_exceptions=True,
+    )
+    for name, result in zip(("coin_index", "rolling_stats", "sentiment"), results):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка прогрева {name}: {result}", exc_info=result)
+    if results[0] is True:
+        logger.info(f"Справочник монет загружен с диска: {len(coin_index)} монет.")
+
+    # Если справочника на диске нет или он устарел — обновляем сразу
+    scheduler.add_job(
+        "coin_list", load_supported_coins, COIN_LIST_REFRESH_INTERVAL,
+        first_run=coin_index.refresh_due_in(COIN_LIST_REFRESH_INTERVAL),
+    )
+    scheduler.start()
+    startup.mark("warm_up")
+    logger.info(f"Прогрев завершён через {startup.elapsed()} с после запуска. Этапы: {startup.phases}")
 
-    updater = Updater(token=TELEGRAM_BOT_TOKEN, use_context=True)
-    dispatcher = updater.dispatcher
-    bot_context = dispatcher  # Сохраняем глобальный контекст для send_telegram_message
+async def post_init(application: Application):
+    global _warm_up_task
+    startup.mark("application")
+    message_sender.start(application.bot)
+    await asyncio.to_thread(setup_channel_alerts)
+
+    # Периодические задачи: источники новостей, снимок рынка, оповещения о ценах
+    setup_scheduled_jobs(application)
+    scheduler.start()
+    startup.mark("post_init")
+    logger.info(f"Бот готов принимать обновления через {startup.elapsed()} с после запуска.")
+    _warm_up_task = asyncio.create_task(warm_up(), name="warm-up")
+
+async def post_shutdown(application: Application):
+    await scheduler.stop()
+    await message_sender.flush()
+    await HTTP_CLIENT.aclose()
+    await asyncio.to_thread(sentiment_service.shutdown)
+
+_warm_up_task = None
+
+def build_application(post_init=post_init, post_shutdown=post_shutdown) -> Application:
+    """Application со всеми обработчиками (без запуска)."""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .concurrent_updates(HANDLER_CONCURRENCY)
+    )
+    if post_init is not None:
+        builder = builder.post_init(post_init)
+    if post_shutdown is not None:
+        builder = builder.post_shutdown(post_shutdown)
+    application = builder.build()
 
     # Команды
-    dispatcher.add_handler(CommandHandler("start", start_command))
-    dispatcher.add_handler(CommandHandler("help", help_command))
-    dispatcher.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("unalert", unalert_command))
 
     # Обработчик обычного текста (кнопки ReplyKeyboard и т.п.)
-    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
-
-    # Запуск бота
-    updater.start_polling()
-    logger.info("Бот запущен и готов к работе.")
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
 
-    # Запуск планировщика в отдельном потоке
-    task_thread = threading.Thread(target=scheduled_tasks, args=(updater,), daemon=True)
-    task_thread.start()
+def main():
+    startup.mark("module")
+    application = build_application()
 
-    updater.idle()
+    # Запуск бота: все обработчики и фоновые задачи работают в одном цикле событий
+    logger.info(f"Бот запущен и готов к работе (режим {TELEGRAM_MODE}).")
+    if TELEGRAM_MODE == "webhook":
+        asyncio.run(run_application(application, webhook=True))
+    elif WORKER_INDEX > 0:
+        # getUpdates может опрашивать только один процесс — это воркер 0
+        asyncio.run(run_application(application, webhook=False))
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,17 @@
+"""
+Оценка тональности в процессах пула SentimentService.
+
+Процессы пула запускаются через spawn и импортируют только этот модуль, поэтому
+в нём нет ничего, кроме VADER: ни хранилища, ни настроек бота, ни atexit.
+"""
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+_analyzer = None
+
+def init_worker():
+    global _analyzer
+    _analyzer = SentimentIntensityAnalyzer()
+
+def score_texts(texts: list) -> list:
+    """compound-оценки VADER для пачки текстов."""
+    return [_analyzer.polarity_scores(t)['compound'] for t in texts]
@@ -1,8 +1,7 @@
 import os
 import json
-import requests
+import httpx
 from dotenv import load_dotenv
-from pycoingecko import CoinGeckoAPI
 import feedparser
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
@@ -14,7 +13,7 @@ TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
 CRYPTOPANIC_API_KEY = os.getenv("CRYPTOPANIC_API_KEY", "")
 NEWSAPI_API_KEY = os.getenv("NEWSAPI_API_KEY", "")
 
-cg = CoinGeckoAPI()
+COINGECKO_API_URL = "https://api.coingecko.com/api/v3"
 analyzer = SentimentIntensityAnalyzer()
 
 def test_cryptopanic():
@@ -28,7 +27,7 @@ def test_cryptopanic():
         "kind": "news",
     }
     try:
-        resp = requests.get(base_url, params=params, timeout=10)
+        resp = httpx.get(base_url, params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
         print("CryptoPanic News:")
@@ -49,7 +48,7 @@ def test_newsapi():
         "pageSize": 5  # Ограничим количество для теста
     }
     try:
-        resp = requests.get(base_url, params=params, timeout=10)
+        resp = httpx.get(base_url, params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
         print("NewsAPI Articles:")
@@ -80,7 +79,13 @@ def test_cointelegraph_rss():
 def test_coin_gecko_prices():
     cryptos = ["bitcoin", "ethereum"]
     try:
-        prices = cg.get_price(ids=cryptos, vs_currencies="usd")
+        resp = httpx.get(
+            f"{COINGECKO_API_URL}/simple/price",
+            params={"ids": ",".join(cryptos), "vs_currencies": "usd"},
+            timeout=10,
+        )
+        resp.raise_for_status()
+        prices = resp.json()
         print("CoinGecko Prices:")
         print(json.dumps(prices, indent=2))
     except Exception as e:
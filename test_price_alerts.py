@@ -0,0 +1,69 @@
+import pytest
+
+from news_ai_bot import ALERT_COOLDOWN, PriceAlertEngine, SqliteStorage
+
+# Текущее время в тестах: при now=0 новое правило (last_fired_at = 0) было бы ещё на паузе
+T0 = 1_700_000_000.0
+
+@pytest.fixture
+def engine(tmp_path):
+    backend = SqliteStorage(str(tmp_path / "state.db"))
+    yield PriceAlertEngine(backend)
+    backend.close()
+
+def market(price: float, change_24h: float = None) -> dict:
+    return {"bitcoin": {"current_price": price, "price_change_percentage_24h_in_currency": change_24h}}
+
+def test_ref_rule_starts_from_current_price(engine):
+    engine.add_rule("1", "bitcoin", 5)
+    assert engine.evaluate(market(100.0), now=T0) == []
+    assert engine.evaluate(market(104.0), now=T0 + 10) == []
+    fired = engine.evaluate(market(106.0), now=T0 + 20)
+    assert fired == [("1", "bitcoin", "ref", 106.0, pytest.approx(6.0))]
+
+def test_ref_rule_moves_reference_after_firing(engine):
+    engine.add_rule("1", "bitcoin", 5, ref_price=100.0)
+    assert len(engine.evaluate(market(106.0), now=T0)) == 1
+    later = T0 + ALERT_COOLDOWN + 1
+    assert engine.evaluate(market(106.0), now=later) == []
+    # От старой опорной цены 100 это +9%, от новой 106 — только +2.8%
+    assert engine.evaluate(market(109.0), now=later + 1) == []
+    assert len(engine.evaluate(market(112.0), now=later + 2)) == 1
+
+def test_hysteresis_needs_move_back_before_firing_again(engine):
+    engine.add_rule("1", "bitcoin", 5, "24h")
+    assert len(engine.evaluate(market(100.0, 6), now=T0)) == 1
+    later = T0 + ALERT_COOLDOWN + 1
+    # Пока изменение не опустилось ниже половины порога, правило не взводится снова
+    assert engine.evaluate(market(100.0, 6), now=later) == []
+    assert engine.evaluate(market(100.0, 4), now=later + 1) == []
+    assert engine.evaluate(market(100.0, 6), now=later + 2) == []
+    assert engine.evaluate(market(100.0, 2), now=later + 3) == []
+    assert len(engine.evaluate(market(100.0, -6), now=later + 4)) == 1
+
+def test_cooldown(engine):
+    engine.add_rule("1", "bitcoin", 5, "24h")
+    assert len(engine.evaluate(market(100.0, 6), now=T0)) == 1
+    assert engine.evaluate(market(100.0, 0), now=T0 + 10) == []
+    assert engine.evaluate(market(100.0, 6), now=T0 + 20) == []
+    assert len(engine.evaluate(market(100.0, 6), now=T0 + ALERT_COOLDOWN)) == 1
+
+def test_remove_rule(engine):
+    for chat in ("1", "2", "3"):
+        engine.add_rule(chat, "bitcoin", 5, "24h")
+    engine.add_rule("1", "bitcoin", 5, "1h")
+    assert engine.remove_rule("1", "bitcoin", "1h")
+    assert engine.rules_for("1") == [("bitcoin", "24h", 5.0)]
+    # Удаление первой строки переносит на её место последнюю
+    assert engine.remove_rule("1", "bitcoin")
+    assert not engine.remove_rule("1", "bitcoin")
+    assert engine.rules_for("1") == []
+    fired = engine.evaluate(market(100.0, 6), now=T0)
+    assert sorted(chat for chat, *_ in fired) == ["2", "3"]
+
+def test_state_survives_reload(engine):
+    engine.add_rule("1", "bitcoin", 5, "24h")
+    assert len(engine.evaluate(market(100.0, 6), now=T0)) == 1
+    reloaded = PriceAlertEngine(engine.backend)
+    assert reloaded.rules_for("1") == [("bitcoin", "24h", 5.0)]
+    assert reloaded.evaluate(market(100.0, 6), now=T0 + ALERT_COOLDOWN + 1) == []
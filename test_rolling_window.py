@@ -0,0 +1,56 @@
+import math
+import random
+
+import pytest
+
+from news_ai_bot import RollingWindow
+
+def brute_force(samples: list, length: float):
+    """Те же метрики, что RollingWindow.stats(), пересчитанные по всем выборкам окна."""
+    last_t = samples[-1][0]
+    window = [(t, p) for t, p in samples if last_t - t <= length]
+    if len(window) < 2:
+        return None
+    prices = [p for _, p in window]
+    returns = [math.log(b / a) for a, b in zip(prices, prices[1:])]
+    mean = sum(returns) / len(returns)
+    return {
+        "change": (prices[-1] / prices[0] - 1) * 100,
+        "stddev": math.sqrt(sum((r - mean) ** 2 for r in returns)) * 100,
+        "range": (max(prices) / min(prices) - 1) * 100,
+        "low": min(prices),
+        "high": max(prices),
+        "coverage": min(1.0, (window[-1][0] - window[0][0]) / length),
+    }
+
+def test_single_sample_has_no_stats():
+    window = RollingWindow(60)
+    window.add(0, 100.0)
+    assert window.stats() is None
+
+def test_ignores_out_of_order_samples():
+    window = RollingWindow(60)
+    window.add(10, 100.0)
+    window.add(5, 1.0)
+    window.add(20, 110.0)
+    assert window.stats()["low"] == 100.0
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_brute_force(seed):
+    rng = random.Random(seed)
+    length = rng.choice([30, 300, 3600])
+    window = RollingWindow(length)
+    samples = []
+    t, price = 0.0, 100.0
+    for _ in range(2000):
+        t += rng.uniform(1, 60)
+        price *= math.exp(rng.gauss(0, 0.02))
+        window.add(t, price)
+        samples.append((t, price))
+        expected = brute_force(samples, length)
+        actual = window.stats()
+        if expected is None:
+            assert actual is None
+            continue
+        for key, value in expected.items():
+            assert actual[key] == pytest.approx(value, rel=1e-6, abs=1e-6), key
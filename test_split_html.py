@@ -0,0 +1,67 @@
+import random
+import re
+
+from news_ai_bot import split_html_message
+
+def visible(chunk: str) -> str:
+    return re.sub(r"<[^>]*>", "", chunk)
+
+def squeeze(text: str) -> str:
+    return re.sub(r"\s+", "", visible(text))
+
+def check_chunks(text: str, limit: int) -> list:
+    chunks = split_html_message(text, limit)
+    for chunk in chunks:
+        assert len(chunk) <= limit
+        assert visible(chunk).strip()
+    assert squeeze("".join(chunks)) == squeeze(text)
+    return chunks
+
+def test_short_message_is_not_split():
+    assert split_html_message("<b>BTC</b> +5%", 100) == ["<b>BTC</b> +5%"]
+
+def test_splits_on_paragraphs():
+    text = "\n\n".join(f"Новость {i}: " + "слово " * 10 for i in range(20))
+    chunks = check_chunks(text, 200)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("Новость") for chunk in chunks)
+
+def test_reopens_tags_in_next_chunk():
+    text = "<b>" + "жирный текст " * 100 + "</b>"
+    chunks = check_chunks(text, 150)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith("<b>") and chunk.endswith("</b>")
+
+def test_does_not_cut_entities():
+    text = "&amp; " * 200
+    for chunk in check_chunks(text, 50):
+        assert not re.search(r"&(?!amp;)", chunk)
+
+def test_long_link_keeps_text_within_limit():
+    link = '<a href="https://example.com/' + "q" * 5000 + '">текст ссылки</a>'
+    text = "слово " * 800 + link + " ещё" * 900
+    chunks = check_chunks(text, 4096)
+    assert any("текст ссылки" in chunk for chunk in chunks)
+    assert not any("<a href" in chunk for chunk in chunks)
+
+def test_link_near_limit_never_leaves_empty_chunk():
+    text = '<a href="https://example.com/' + "z" * 4070 + '">t</a>' + " w" * 3000
+    check_chunks(text, 4096)
+
+def test_random_markup():
+    rng = random.Random(1)
+    for _ in range(300):
+        limit = rng.randint(20, 200)
+        parts = []
+        for _ in range(rng.randint(1, 40)):
+            roll = rng.random()
+            if roll < 0.15:
+                tag = rng.choice(["b", "i", "a"])
+                attrs = ' href="' + "u" * rng.randint(0, limit) + '"' if tag == "a" else ""
+                parts.append(f"<{tag}{attrs}>{rng.choice(['w', 'hello world', '&amp;', ''])}</{tag}>")
+            elif roll < 0.25:
+                parts.append(rng.choice(["\n", "\n\n", " "]))
+            else:
+                parts.append("w" * rng.randint(1, limit))
+        check_chunks("".join(parts) + " " * limit + "z" * limit, limit)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from news_ai_bot import WebhookServer
+
+SECRET = "secret"
+UPDATE = json.dumps({"update_id": 1}).encode()
+
+def run(scenario, **server_args):
+    """Запускает WebhookServer без обработчиков (апдейты остаются в очереди) и scenario(server)."""
+    async def main():
+        server = WebhookServer(path="/telegram", secret=SECRET, workers=0, **server_args)
+        await server.start(SimpleNamespace(bot=None), "127.0.0.1", 0, reuse_port=False)
+        try:
+            return await scenario(server)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+async def request(server, raw: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(raw)
+    await writer.drain()
+    response = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    return response
+
+def post(body: bytes = UPDATE, path: str = "/telegram", secret: str = SECRET, extra: str = None) -> bytes:
+    headers = extra if extra is not None else f"Content-Length: {len(body)}\r\n"
+    return (
+        f"POST {path} HTTP/1.1\r\nX-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+        f"{headers}Connection: close\r\n\r\n"
+    ).encode() + body
+
+def status(response: bytes) -> int:
+    return int(response.split(b" ", 2)[1])
+
+def test_accepts_update():
+    async def scenario(server):
+        assert status(await request(server, post())) == 200
+        assert server.queue.qsize() == 1
+    run(scenario)
+
+def test_health_check_and_head_without_body():
+    async def scenario(server):
+        response = await request(server, b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+        assert status(response) == 200 and response.endswith(b"\r\n\r\nOK")
+        response = await request(server, b"HEAD /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+        assert status(response) == 200 and response.endswith(b"\r\n\r\n")
+    run(scenario)
+
+def test_rejects_wrong_path_method_and_secret():
+    async def scenario(server):
+        assert status(await request(server, post(path="/other"))) == 404
+        assert status(await request(server, post().replace(b"POST", b"PUT", 1))) == 405
+        assert status(await request(server, post(secret="wrong"))) == 403
+        assert server.queue.qsize() == 0
+    run(scenario)
+
+def test_rejects_bad_requests():
+    async def scenario(server):
+        assert status(await request(server, b"GARBAGE\r\n\r\n")) == 400
+        assert status(await request(server, post(b"{not json"))) == 400
+        for length in ("-1", "+2", "abc", "٣"):
+            assert status(await request(server, post(extra=f"Content-Length: {length}\r\n"))) == 400
+        assert status(await request(server, post(extra="Transfer-Encoding: chunked\r\n"))) == 411
+        assert status(await request(server, post(extra="Content-Length: 999999999\r\n"))) == 413
+        assert server.queue.qsize() == 0
+    run(scenario)
+
+def test_queue_full():
+    async def scenario(server):
+        assert status(await request(server, post())) == 200
+        assert status(await request(server, post())) == 503
+        assert server.stats()["queue_full"] == 1
+    run(scenario, queue_size=1)